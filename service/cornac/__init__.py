@@ -1,24 +1,38 @@
 import os.path
 from pathlib import Path
-from pkg_resources import get_distribution
 from warnings import filterwarnings
 
-from flask import Flask
-
 
 # psycopg2 and psycopg2-binary is a mess. You can't define OR dependency in
 # Python. Just globally ignore this for now.
 filterwarnings("ignore", message="The psycopg2 wheel package will be renamed")  # noqa
 
 
-try:
-    dist = get_distribution('pgCornac')
-    __version__ = dist.version
-except Exception:
-    __version__ = 'unknown'
+def get_distribution_version(name):
+    # importlib.metadata is much cheaper than pkg_resources, which scans all
+    # distributions on import.
+    try:
+        from importlib.metadata import version
+    except ImportError:  # Python < 3.8
+        from pkg_resources import get_distribution
+
+        def version(name):
+            return get_distribution(name).version
+
+    try:
+        return version(name)
+    except Exception:
+        return 'unknown'
 
 
-def create_app(environ=os.environ):
+__version__ = get_distribution_version('pgCornac')
+
+
+def create_app(environ=os.environ, web=True, worker=True):
+    # Import Flask lazily, importing cornac package must stay cheap. web and
+    # worker allow CLI commands to skip slow imports of blueprints and task
+    # broker. Web requires worker to queue tasks.
+    from flask import Flask
 
     app = Flask(__name__, instance_path=str(Path.home()))
 
@@ -28,11 +42,18 @@ def create_app(environ=os.environ):
     from .core.model import db
     db.init_app(app)
 
-    from .web import rds, fallback
-    app.register_blueprint(rds)
-    app.errorhandler(404)(fallback)
+    if web:
+        from .web import metrics, rds, ready, fallback
+        app.register_blueprint(metrics)
+        app.register_blueprint(rds)
+        app.register_blueprint(ready)
+        app.errorhandler(404)(fallback)
+
+    if web or worker:
+        from .worker import dramatiq
+        dramatiq.init_app(app)
 
-    from .worker import dramatiq
-    dramatiq.init_app(app)
+    from .ssh import control_masters
+    control_masters.persist = int(app.config['SSH_CONTROL_PERSIST'] or 0)
 
     return app
@@ -15,33 +15,46 @@ from platform import python_version
 from textwrap import dedent
 from urllib.parse import urlparse
 
-import bjoern
 import click
 from flask import current_app, __version__ as flask_version
-from flask.cli import FlaskGroup
+from flask.cli import FlaskGroup, pass_script_info
 from flask.globals import _app_ctx_stack
-from pkg_resources import get_distribution
-from sqlalchemy.exc import IntegrityError
 from werkzeug import __version__ as werkzeug_version
 
-from . import create_app, worker, __version__
-from .core.config import require_ssh_key
-from .core.config.writer import append_credentials
-from .core.model import DBInstance, db, connect
-from .core.user import generate_key, generate_secret
-from .core.schema import Migrator
+from . import create_app, get_distribution_version, __version__
 from .errors import KnownError
-from .iaas import IaaS
-from .operator import BasicOperator
-from .ssh import wait_machine
+
+# Commands import their dependencies lazily. SQLAlchemy, dramatiq, bjoern,
+# IaaS SDKs, etc. are slow to import and most commands need only a few of
+# them. tests/unit/test_cli.py checks that importing this module stays cheap.
 
 
 logger = logging.getLogger(__name__)
+# Parts of app needed by commands, see create_app. Other commands, like serve
+# or Flask commands, load the whole app.
+COMMAND_APPS = {
+    'bootstrap': dict(web=False, worker=False),
+    'exec': dict(web=False),
+    'generate-credentials': dict(web=False, worker=False),
+    'inspect': dict(web=False),
+    'migratedb': dict(web=False, worker=False),
+    'recover': dict(web=False),
+    'watch': dict(web=False),
+    'worker': dict(web=False),
+}
 
 
 class CornacGroup(FlaskGroup):
     # Wrapper around FlaskGroup to lint error handling.
 
+    def get_command(self, ctx, name):
+        # Resolve own commands before loading plugin commands. Loading plugins
+        # imports pkg_resources and dramatiq.
+        rv = click.Group.get_command(self, ctx, name)
+        if rv is not None:
+            return rv
+        return super().get_command(ctx, name)
+
     def main(self, *a, **kw):
         try:
             return super().main(*a, **kw)
@@ -54,21 +67,26 @@ class CornacGroup(FlaskGroup):
 def get_version(ctx, param, value):
     if not value or ctx.resilient_parsing:
         return
-    bjoern = get_distribution('bjoern')
+    bjoern = get_distribution_version('bjoern')
     python = python_version()
     click.echo(
         f"Cornac {__version__} ("
         f"Python {python}, "
         f"Flask {flask_version}, "
         f"Werkzeug {werkzeug_version}, "
-        f"Bjoern {bjoern.version}"
+        f"Bjoern {bjoern}"
         ")"
     )
     ctx.exit()
 
 
+def create_cli_app(script_info):
+    return create_app(**script_info.data.get('app', {}))
+
+
 # Root group of CLI.
-@click.group(cls=CornacGroup, create_app=create_app, add_version_option=False)
+@click.group(
+    cls=CornacGroup, create_app=create_cli_app, add_version_option=False)
 @click.option('--verbose/--quiet', default=False)
 @click.option('--version', is_flag=True, is_eager=True,
               expose_value=False, callback=get_version,
@@ -76,6 +94,8 @@ def get_version(ctx, param, value):
 @click.pass_context
 def root(ctx, verbose):
     appname = ctx.invoked_subcommand or 'cornac'
+    # Tell create_cli_app what the command needs.
+    ctx.obj.data['app'] = COMMAND_APPS.get(ctx.invoked_subcommand, {})
     systemd = 'SYSTEMD' in os.environ
     setup_logging(appname=appname, verbose=verbose, systemd=systemd)
 
@@ -93,6 +113,12 @@ def root(ctx, verbose):
               show_default=True, metavar='SIZE_GB',)
 @click.pass_context
 def bootstrap(ctx, pgversion, size):
+    from sqlalchemy.exc import IntegrityError
+    from .core.config import require_ssh_key
+    from .core.model import DBInstance, db
+    from .iaas import IaaS
+    from .operator import BasicOperator
+
     require_ssh_key()
     connstring = current_app.config['SQLALCHEMY_DATABASE_URI']
     pgurl = urlparse(connstring)
@@ -127,10 +153,64 @@ def bootstrap(ctx, pgversion, size):
         logger.debug("Done")
 
 
-@root.command(help="Generate access token")
+@root.command(name='exec', help=dedent("""\
+    Run a pghelper.sh command on many instances.
+
+    Selects available instances, unless filtered by db-instance-status. Filters
+    accept RDS filter names, e.g. --filter engine-version=10,11. Prints output
+    of each instance as soon as it completes.
+    """))
+@click.option('--filter', 'filters', multiple=True,
+              help="Select instances with an RDS filter.",
+              metavar='NAME=VALUE[,VALUE...]')
+@click.option('--concurrency', default=None, type=click.IntRange(1),
+              help="Number of concurrent SSH sessions. [default: "
+              "EXEC_CONCURRENCY]",
+              metavar='N')
+@click.option('--background', is_flag=True, default=False,
+              help="Queue command to worker, which logs results.")
+@click.argument('command', nargs=-1, required=True)
+def exec_(filters, concurrency, background, command):
+    from .core.config import require_ssh_key
+    from .fleet import iter_exec, parse_filter, select_targets
+
+    filters = [parse_filter(f) for f in filters]
+    concurrency = concurrency or current_app.config['EXEC_CONCURRENCY']
+    if background:
+        from . import worker
+
+        logger.info("Queuing execution of %s.", ' '.join(command))
+        worker.exec_instances.send(filters, command, concurrency)
+        return
+
+    require_ssh_key()
+    targets = select_targets(filters)
+    logger.info(
+        "Running %s on %s instances.", ' '.join(command), len(targets))
+    failures = 0
+    for result in iter_exec(targets, command, concurrency):
+        if result.error:
+            failures += 1
+            logger.error(
+                "%s failed in %.3fs: %s.",
+                result.identifier, result.duration, result.error)
+            continue
+
+        logger.info("%s done in %.3fs.", result.identifier, result.duration)
+        for line in result.output.splitlines():
+            click.echo(f"{result.identifier}: {line}")
+
+    if failures:
+        raise KnownError(f"Command failed on {failures} instances.")
+
+
+@root.command(help="Generate access token", with_appcontext=False)
 @click.option('--save', is_flag=True, default=False,
-              help="Save in configuration file.")
-def generate_credentials(save):
+              help="Save in cornac database.")
+@pass_script_info
+def generate_credentials(info, save):
+    from .core.user import generate_key, generate_secret
+
     access_key = generate_key()
     secret_key = generate_secret()
     sys.stdout.write(dedent(f"""\
@@ -141,48 +221,42 @@ def generate_credentials(save):
     if not save:
         return
 
-    path, *_ = current_app.config['CONFIG'].split(',')
-    logging.info("Saving credentials to %s.", path)
-    new_file = not os.path.exists(path)
-    if new_file:
-        config = dedent("""
-        # Created by cornac generate-credentials. Edit to adjust to your needs.
-        """)
-    else:
-        with open(path) as fo:
-            config = fo.read()
-
-    if "CREDENTIALS = {" not in config:
-        config += dedent("""
-        CREDENTIALS = {}
-        """)
+    # Load app only when needed, generating credentials is a pure function.
+    app = info.load_app()
+    from .core.model import Credential, db
 
-    node = append_credentials(config, access_key, secret_key)
-
-    with open(path, 'w') as fo:
-        if new_file:
-            os.chmod(path, 0o600)
-        fo.write(str(node))
+    logging.info("Saving credentials to database.")
+    with app.app_context():
+        credential = Credential()
+        credential.access_key = access_key
+        credential.secret_key = secret_key
+        db.session.add(credential)
+        db.session.commit()
 
 
 @root.command(help="Inspect IaaS to update inventory.")
 @click.argument('identifier', default='__all__')
 def inspect(identifier):
-    qry = DBInstance.query
+    from . import worker
+    from .core.model import DBInstance
+
     if identifier == '__all__':
-        instances = qry.all()
-    else:
-        instance = qry.filter(DBInstance.identifier == identifier).one()
-        instances = [instance]
+        logger.debug("Queuing inspection of all instances.")
+        worker.inspect_instances.send()
+        return
 
-    for instance in instances:
-        logger.debug("Queuing inspection of %s.", instance)
-        worker.inspect_instance.send(instance.id)
+    qry = DBInstance.query
+    instance = qry.filter(DBInstance.identifier == identifier).one()
+    logger.debug("Queuing inspection of %s.", instance)
+    worker.inspect_instance.send(instance.id)
 
 
 @root.command(help="Serve on HTTP for production.")
+@click.option('--workers', default=1, type=click.IntRange(1),
+              help="Number of pre-forked server processes.",
+              show_default=True, metavar='N')
 @click.argument('listen', default='')
-def serve(listen):
+def serve(workers, listen):
     host, _, port = listen.partition(':')
     host = host or 'localhost'
     port = int(port or 5000)
@@ -194,7 +268,12 @@ def serve(listen):
 
     logger.info("Serving on http://%s:%s/.", host, port)
     try:
-        bjoern.run(ctx.app, host, port)
+        if workers > 1:
+            from .prefork import PreforkServer
+            PreforkServer(ctx.app, host, port, workers=workers).run()
+        else:
+            import bjoern
+            bjoern.run(ctx.app, host, port)
     finally:
         # Push back ctx so that CLI context is preserved
         ctx.push()
@@ -204,6 +283,9 @@ def serve(listen):
 @click.option('--dry/--no-dry', default=True,
               help="Whether to effectively apply migration script.")
 def migratedb(dry):
+    from .core.model import connect
+    from .core.schema import Migrator
+
     migrator = Migrator()
     migrator.inspect_available_versions()
     with connect(current_app.config['SQLALCHEMY_DATABASE_URI']) as conn:
@@ -232,6 +314,11 @@ def migratedb(dry):
 @click.option('--instances/--no-instances', default=False,
               help="Start/stop instances according to inventory status.")
 def recover(instances):
+    from . import worker
+    from .core.model import connect
+    from .iaas import IaaS
+    from .ssh import wait_machine
+
     with IaaS.connect(current_app.config['IAAS'], current_app.config) as iaas:
         iaas.start_machine('cornac')
     connstring = current_app.config['SQLALCHEMY_DATABASE_URI']
@@ -249,6 +336,17 @@ def recover(instances):
                     "each instances.")
         worker.recover_instances()
 
+    if current_app.config['WARM_POOL']:
+        logger.info("Queuing refill of warm pool.")
+        worker.refill_warm_pool.send()
+
+
+@root.command(help="Update inventory from IaaS power events.")
+def watch():
+    from .watch import watch
+
+    watch(current_app.config)
+
 
 def entrypoint():
     debug = os.environ.get('DEBUG', '').lower() in ('1', 'y')
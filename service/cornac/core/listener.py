@@ -0,0 +1,116 @@
+#
+# Receive Postgres notifications in a background thread.
+#
+# Each process has a single LISTEN connection per app, opened lazily by the
+# first subscriber. Callbacks receive notification payload. When notifications
+# may have been missed, callbacks receive None: right after LISTEN and when
+# connection is lost. Subscribers must not trust a cache unless the listener is
+# listening on their channel.
+#
+
+import logging
+import os
+import select
+import threading
+from time import sleep
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+
+logger = logging.getLogger(__name__)
+
+
+class Listener(object):
+    reconnect_delay = 5
+
+    @classmethod
+    def for_app(cls, app):
+        if 'cornac.listener' not in app.extensions:
+            app.extensions['cornac.listener'] = cls(
+                app.config['SQLALCHEMY_DATABASE_URI'])
+        return app.extensions['cornac.listener']
+
+    def __init__(self, connstring):
+        self.connstring = connstring
+        self.callbacks = {}
+        self.listening = set()
+        self.lock = threading.Lock()
+        # The thread does not survive fork. Track owner process to restart it
+        # in children.
+        self.pid = None
+
+    def is_listening(self, channel):
+        return self.pid == os.getpid() and channel in self.listening
+
+    def subscribe(self, channel, callback):
+        with self.lock:
+            callbacks = self.callbacks.setdefault(channel, [])
+            if callback not in callbacks:
+                callbacks.append(callback)
+        self.ensure_running()
+
+    def ensure_running(self):
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.listening = set()
+            thread = threading.Thread(
+                target=self.run, name='cornac-listener', daemon=True)
+            thread.start()
+
+    def dispatch(self, channel, payload):
+        for callback in self.callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception:
+                logger.exception("Unhandled error in %s callback:", channel)
+
+    def run(self):
+        while True:
+            try:
+                self.listen()
+            except Exception as e:
+                logger.warning("Lost Postgres notifications: %s.", e)
+            finally:
+                listening, self.listening = self.listening, set()
+                for channel in listening:
+                    self.dispatch(channel, None)
+            sleep(self.reconnect_delay)
+
+    def listen(self):
+        conn = psycopg2.connect(
+            self.connstring,
+            # Detect dead connection in a timely manner.
+            keepalives=1,
+            keepalives_idle=10,
+            keepalives_interval=5,
+            keepalives_count=3,
+        )
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        try:
+            while True:
+                for channel in set(self.callbacks) - self.listening:
+                    logger.debug("Listening on %s.", channel)
+                    with conn.cursor() as cur:
+                        cur.execute(sql.SQL("LISTEN {};").format(
+                            sql.Identifier(channel)))
+                    self.listening.add(channel)
+                    # Notifications may have been missed before LISTEN.
+                    self.dispatch(channel, None)
+
+                # Timeout allows to LISTEN on new channels.
+                if select.select([conn], [], [], 1) == ([], [], []):
+                    continue
+
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    self.dispatch(notify.channel, notify.payload)
+        finally:
+            conn.close()
@@ -48,6 +48,17 @@ DBInstanceStatus = ENUM(
 )
 
 
+class Credential(db.Model):
+    __tablename__ = 'credentials'
+
+    access_key = db.Column(db.String, primary_key=True)
+    secret_key = db.Column(db.String, nullable=False)
+    ctime = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+
+    def __str__(self):
+        return f'credential {self.access_key}'
+
+
 class DBInstance(db.Model):
     __tablename__ = 'db_instances'
 
@@ -61,3 +72,20 @@ class DBInstance(db.Model):
 
     def __str__(self):
         return f'instance #{self.id} {self.identifier} ({self.status})'
+
+
+class WarmMachine(db.Model):
+    __tablename__ = 'warm_machines'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False)
+    storage_pool = db.Column(db.String, nullable=False)
+    engine_version = db.Column(db.String, nullable=False)
+    allocated_storage = db.Column(db.Integer, nullable=False)
+    ready = db.Column(db.Boolean, nullable=False, default=False)
+    ctime = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+    # Last provisioning start or claim.
+    mtime = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+
+    def __str__(self):
+        return f'warm machine {self.name}'
@@ -0,0 +1,4 @@
+-- Speed up DescribeDBInstances filters. jsonb_path_ops serves containment
+-- operator @> on data keys.
+CREATE INDEX ON db_instances USING GIN ("data" jsonb_path_ops);
+CREATE INDEX ON db_instances (status);
@@ -0,0 +1,12 @@
+-- Notify web processes of inventory changes, to invalidate their cache.
+CREATE FUNCTION notify_db_instances() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM pg_notify('db_instances', TG_OP);
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER notify_db_instances
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON db_instances
+FOR EACH STATEMENT EXECUTE PROCEDURE notify_db_instances();
@@ -0,0 +1,20 @@
+-- RDS API credentials. Secret key is kept as is since SigV4 signature is an
+-- HMAC keyed by the secret.
+CREATE TABLE credentials (
+  access_key TEXT PRIMARY KEY,
+  secret_key TEXT NOT NULL,
+  ctime TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+-- Notify web processes to reload their credentials cache.
+CREATE FUNCTION notify_credentials() RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+  PERFORM pg_notify('credentials', TG_OP);
+  RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER notify_credentials
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON credentials
+FOR EACH STATEMENT EXECUTE PROCEDURE notify_credentials();
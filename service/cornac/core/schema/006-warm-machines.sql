@@ -0,0 +1,15 @@
+-- Machines provisioned in advance, with Postgres initialized. CreateDBInstance
+-- claims a ready machine matching storage pool, version and size.
+CREATE TABLE warm_machines (
+  id BIGSERIAL PRIMARY KEY,
+  name TEXT UNIQUE NOT NULL,
+  storage_pool TEXT NOT NULL,
+  engine_version TEXT NOT NULL,
+  allocated_storage INTEGER NOT NULL,
+  ready BOOLEAN NOT NULL DEFAULT FALSE,
+  ctime TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
+);
+
+CREATE INDEX warm_machines_ready_idx
+ON warm_machines (storage_pool, engine_version, allocated_storage)
+WHERE ready;
@@ -0,0 +1,4 @@
+-- Track last state change of warm machines, to reap machines left unready by
+-- a dead worker.
+ALTER TABLE warm_machines
+ADD COLUMN mtime TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW();
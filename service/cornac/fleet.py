@@ -0,0 +1,68 @@
+#
+# Run pghelper.sh commands on many instances.
+#
+# Commands run concurrently in a bounded pool of threads, each with its own
+# SSH session. Results are yielded as soon as each command completes, slowest
+# hosts last.
+#
+
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import monotonic
+
+from .core.model import DBInstance
+from .errors import KnownError
+from .operator import BasicOperator
+from .ssh import RemoteShell
+from .web.actions import FILTERS, filter_instances
+
+
+logger = logging.getLogger(__name__)
+ExecResult = namedtuple('ExecResult', 'identifier duration output error')
+
+
+def parse_filter(expr):
+    # Parse NAME=VALUE[,VALUE...] as a (name, values) RDS filter.
+    name, _, values = expr.partition('=')
+    if name not in FILTERS:
+        raise KnownError(
+            f"Unknown filter {name}. Use one of {', '.join(sorted(FILTERS))}.")
+    if not values:
+        raise KnownError(f"Filter {name} requires at least one value.")
+    return name, values.split(',')
+
+
+def select_targets(filters):
+    # Returns a list of (identifier, address) of instances matching filters.
+    # Without status filter, selects available instances.
+    if not any('db-instance-status' == name for name, _ in filters):
+        filters = list(filters) + [('db-instance-status', ['available'])]
+    qry = filter_instances(DBInstance.query, filters)
+    return [
+        (instance.identifier, instance.data['Endpoint']['Address'])
+        for instance in qry.order_by(DBInstance.identifier)
+        if (instance.data or {}).get('Endpoint')
+    ]
+
+
+def iter_exec(targets, command, concurrency=16):
+    # Run pghelper.sh command on (identifier, address) targets. Yields
+    # ExecResult in completion order.
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = [
+            executor.submit(exec_helper, identifier, address, command)
+            for identifier, address in targets
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def exec_helper(identifier, address, command):
+    shell = RemoteShell('root', address)
+    start = monotonic()
+    try:
+        output = shell([BasicOperator.helper] + list(command))
+    except Exception as e:
+        return ExecResult(identifier, monotonic() - start, None, str(e))
+    return ExecResult(identifier, monotonic() - start, output, None)
@@ -0,0 +1,71 @@
+#
+# Deploy helper scripts on guests.
+#
+# cornac operates guests through shell scripts installed in /usr/local/bin.
+# Helpers are deployed as a whole, identified by a hash of their content.
+# Guests store the hash of their helpers in HASH_PATH. cornac sends helpers
+# only when hashes differ, as a single tar stream on SSH stdin. Machines
+# cloned from a guest with current helpers need no copy.
+#
+
+import functools
+import io
+import logging
+import tarfile
+from hashlib import sha256
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+# Maps guest path to local path of helpers.
+HELPERS = {
+    '/usr/local/bin/pghelper.sh': (
+        Path(__file__).parent / 'operator' / 'pghelper.sh'),
+    '/usr/local/bin/vhelper.sh': Path(__file__).parent / 'iaas' / 'vhelper.sh',
+}
+HASH_PATH = '/usr/local/share/cornac/helpers.sha256'
+
+
+@functools.lru_cache()
+def helpers_archive():
+    # Returns hash and tar archive of helpers, computed once per process.
+    files = {
+        remote: local.read_bytes()
+        for remote, local in sorted(HELPERS.items())
+    }
+    digest = sha256()
+    for remote, content in files.items():
+        digest.update(remote.encode('utf-8') + b'\0' + content + b'\0')
+    hash_ = digest.hexdigest()
+    files[HASH_PATH] = f"{hash_}\n".encode('utf-8')
+
+    fo = io.BytesIO()
+    with tarfile.open(fileobj=fo, mode='w') as tar:
+        for remote, content in files.items():
+            info = tarfile.TarInfo(remote.lstrip('/'))
+            info.size = len(content)
+            info.mode = 0o644 if remote == HASH_PATH else 0o755
+            tar.addfile(info, io.BytesIO(content))
+    return hash_, fo.getvalue()
+
+
+def deploy_helpers(shell):
+    # Ensure guest behind RemoteShell has current helpers. Returns whether
+    # helpers have been sent.
+    hash_, archive = helpers_archive()
+    current = shell(["sh", "-c", f"cat {HASH_PATH} 2>/dev/null || true"])
+    if current.strip() == hash_:
+        logger.debug("Guest helpers are up to date.")
+        return False
+
+    logger.debug("Sending helpers %.8s.", hash_)
+    shell(["tar", "-x", "-C", "/", "-f", "-"], input=archive)
+    return True
+
+
+def extract_helpers(directory):
+    # Extract helpers in a local directory, e.g. to copy them in a disk image.
+    _, archive = helpers_archive()
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
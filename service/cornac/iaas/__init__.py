@@ -63,3 +63,8 @@ class IaaS(object):
 
     def machine_name(self, name):
         return self.prefix + name
+
+    def ping(self):
+        # Health check of IaaS session. Returns False or raises an exception
+        # if session is unusable.
+        return True
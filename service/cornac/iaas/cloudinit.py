@@ -0,0 +1,66 @@
+#
+# Customize guests on first boot with cloud-init.
+#
+# cornac generates a NoCloud seed: an ISO image labelled cidata, with
+# meta-data, user-data and network-config files. cloud-init reads it from
+# CD-ROM on first boot to set hostname, root SSH key and network. Origin
+# machine must have cloud-init installed. cloud-init disables itself after
+# first boot, so that later changes like hostname are preserved.
+#
+# cf.
+# https://cloudinit.readthedocs.io/en/latest/topics/datasources/nocloud.html
+#
+
+import json
+import os.path
+from tempfile import TemporaryDirectory
+
+from ..ready import phone_home_command
+from ..ssh import logged_cmd
+
+
+def build_seed(hostname, ssh_key=None, phone_home_url=None):
+    # Returns a mapping of filename to content. JSON is valid YAML.
+    meta_data = {
+        'instance-id': hostname,
+        'local-hostname': hostname,
+    }
+    user_data = {
+        'hostname': hostname,
+        'preserve_hostname': False,
+        # cornac operates guests as root.
+        'disable_root': False,
+        'ssh_pwauth': False,
+        'runcmd': [['touch', '/etc/cloud/cloud-init.disabled']],
+    }
+    if ssh_key:
+        user_data['users'] = [dict(name='root', ssh_authorized_keys=[ssh_key])]
+    if phone_home_url:
+        user_data['runcmd'].append(
+            ['sh', '-c', phone_home_command(phone_home_url)])
+    network_config = {
+        'version': 2,
+        'ethernets': {
+            'primary': {'match': {'name': 'e*'}, 'dhcp4': True},
+        },
+    }
+    return {
+        'meta-data': json.dumps(meta_data, indent=2) + '\n',
+        'user-data': (
+            '#cloud-config\n' + json.dumps(user_data, indent=2) + '\n'),
+        'network-config': json.dumps(network_config, indent=2) + '\n',
+    }
+
+
+def write_seed_iso(path, files):
+    with TemporaryDirectory(prefix='cornac-seed-') as tmpdir:
+        for name, content in files.items():
+            with open(os.path.join(tmpdir, name), 'w') as fo:
+                fo.write(content)
+        logged_cmd([
+            "genisoimage",
+            "-output", path,
+            "-volid", "cidata",
+            "-joliet", "-rock",
+            "-quiet",
+        ] + [os.path.join(tmpdir, name) for name in sorted(files)])
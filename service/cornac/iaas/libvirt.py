@@ -6,15 +6,21 @@
 
 import logging
 import os
+import queue
+import threading
 from copy import deepcopy
 from string import ascii_lowercase
+from tempfile import TemporaryDirectory
 from xml.etree import ElementTree as ET
-from time import sleep
+from time import monotonic
 
 import libvirt
 
 from . import IaaS
+from .cloudinit import build_seed, write_seed_iso
 from ..errors import Timeout
+from ..helpers import extract_helpers
+from ..ready import phone_home_command, phone_home_url
 from ..ssh import logged_cmd
 
 
@@ -22,22 +28,82 @@ logger = logging.getLogger(__name__)
 
 
 _1G = 1024 * 1024 * 1024
+# Maps lifecycle events to power events.
+POWER_EVENTS = {
+    libvirt.VIR_DOMAIN_EVENT_CRASHED: 'crashed',
+    libvirt.VIR_DOMAIN_EVENT_RESUMED: 'running',
+    libvirt.VIR_DOMAIN_EVENT_STARTED: 'running',
+    libvirt.VIR_DOMAIN_EVENT_STOPPED: 'stopped',
+}
+_event_loop_lock = threading.Lock()
+_event_loop_registered = False
+_event_loop_pid = None
+
+
+def ensure_event_loop():
+    # libvirt dispatches domain events and connection keepalive through an
+    # event loop. The event loop implementation must be registered before
+    # opening connections. It runs in a daemon thread, which does not survive
+    # fork.
+    global _event_loop_pid, _event_loop_registered
+
+    with _event_loop_lock:
+        if _event_loop_pid == os.getpid():
+            return
+        if not _event_loop_registered:
+            libvirt.virEventRegisterDefaultImpl()
+            _event_loop_registered = True
+        _event_loop_pid = os.getpid()
+        thread = threading.Thread(
+            target=run_event_loop, name='libvirt-events', daemon=True)
+        thread.start()
+
+
+def run_event_loop():
+    while True:
+        libvirt.virEventRunDefaultImpl()
 
 
 class LibVirtIaaS(IaaS):
     @classmethod
     def connect(cls, url, config):
+        ensure_event_loop()
         return cls(libvirt.open(), config)
 
     def __init__(self, conn, config):
         self.conn = conn
         self.config = config
+        # Events set on lifecycle event of domain, by domain name.
+        self.waiters = {}
+        self.waiters_lock = threading.Lock()
+        self.waiters_callback = None
         # Configuration Keys:
         #
         # DEPLOY_KEY: SSH public key to inject to access root account
         #                  on new machines.
         # DNS_DOMAIN: DNS domain to build FQDN of machine on the IaaS.
 
+    def attach_cdrom(self, domain, volume):
+        xml = domain.XMLDesc()
+        path = volume.path()
+        if path in xml:
+            logger.debug("CD-ROM %s already attached.", path)
+            return
+
+        xml = ET.fromstring(xml)
+        xscsitargets = xml.findall(".//disk/target[@bus='scsi']")
+        xdisk = ET.SubElement(
+            xml.find('./devices'), 'disk', type='file', device='cdrom')
+        ET.SubElement(xdisk, 'driver', name='qemu', type='raw')
+        ET.SubElement(xdisk, 'source', file=path)
+        ET.SubElement(
+            xdisk, 'target', bus='scsi',
+            dev='sd' + ascii_lowercase[len(xscsitargets)])
+        ET.SubElement(xdisk, 'readonly')
+
+        logger.debug("Attaching CD-ROM %s.", path)
+        self.conn.defineXML(ET.tostring(xml, encoding="unicode"))
+
     def attach_disk(self, domain, disk):
         xml = domain.XMLDesc()
         path = disk.path()
@@ -66,6 +132,11 @@ class LibVirtIaaS(IaaS):
         self.conn.defineXML(xml)
 
     def close(self):
+        if self.waiters_callback is not None:
+            try:
+                self.conn.domainEventDeregisterAny(self.waiters_callback)
+            except libvirt.libvirtError as e:
+                logger.debug("Failed to deregister events callback: %s.", e)
         self.conn.close()
 
     def create_disk(self, pool, name, size_gb):
@@ -79,21 +150,35 @@ class LibVirtIaaS(IaaS):
             logger.debug("Reusing disk %s.", name)
             return disk
 
-        # For now, just clone definition of first disk found in pool.
-        vol0 = pool.listAllVolumes()[0]
-        xvol = ET.fromstring(vol0.XMLDesc())
-        xvol.find('./name').text = name
-        xvol.find('./capacity').text = "%d" % (size_gb * _1G)
+        logger.debug("Creating disk %s.", name)
         # Prallocate 256K, for partition, PV metadata and mkfs.
-        xvol.find('./allocation').text = "%d" % (256 * 1024,)
+        return pool.createXML(build_volume_xml(
+            name, size_gb * _1G, format_='qcow2', allocation=256 * 1024))
 
-        xvol.remove(xvol.find('./key'))
-        xvol.remove(xvol.find('./physical'))
-        xtarget = xvol.find('./target')
-        xtarget.remove(xtarget.find('./path'))
+    def create_seed(self, pool, name):
+        # Upload a cloud-init seed ISO to storage pool.
+        pool = self.conn.storagePoolLookupByName(pool)
+        volname = f"{name}-seed.iso"
+        try:
+            pool.storageVolLookupByName(volname).delete(0)
+        except libvirt.libvirtError:
+            pass
 
-        logger.debug("Creating disk %s.", name)
-        return pool.createXML(ET.tostring(xvol, encoding='unicode'))
+        files = build_seed(
+            name, ssh_key=self.config['DEPLOY_KEY'],
+            phone_home_url=phone_home_url(self.config, name))
+        with TemporaryDirectory(prefix='cornac-') as tmpdir:
+            iso = os.path.join(tmpdir, 'seed.iso')
+            write_seed_iso(iso, files)
+            size = os.path.getsize(iso)
+            logger.debug("Uploading seed %s.", volname)
+            volume = pool.createXML(build_volume_xml(volname, size))
+            stream = self.conn.newStream(0)
+            volume.upload(stream, 0, size, 0)
+            with open(iso, 'rb') as fo:
+                stream.sendAll(lambda stream, size, fo: fo.read(size), fo)
+            stream.finish()
+        return volume
 
     def create_machine(self, name, storage_pool, data_size_gb, **kw):
         name = f"{self.prefix}{name}"
@@ -101,39 +186,62 @@ class LibVirtIaaS(IaaS):
         try:
             domain = self.conn.lookupByName(name)
         except libvirt.libvirtError:
-            clone_cmd = [
-                "virt-clone",
-                "--original", self.origin,
-                "--name", name,
-                "--auto-clone",
-            ]
-            logger.debug("Allocating machine %s.", name)
-            logged_cmd(clone_cmd)
-            domain = self.conn.lookupByName(name)
+            if self.config['LIBVIRT_LINKED_CLONE']:
+                domain = self.linked_clone(name)
+            else:
+                clone_cmd = [
+                    "virt-clone",
+                    "--original", self.origin,
+                    "--name", name,
+                    "--auto-clone",
+                ]
+                logger.debug("Allocating machine %s.", name)
+                logged_cmd(clone_cmd)
+                domain = self.conn.lookupByName(name)
         else:
             logger.debug("Reusing VM %s.", name)
 
         state, _ = domain.state()
         if libvirt.VIR_DOMAIN_SHUTOFF == state:
-            prepare_cmd = [
-                "virt-sysprep",
-                "--domain", name,
-                "--hostname", name,
-                "--selinux-relabel",
-            ]
-            if self.config['DEPLOY_KEY']:
-                prepare_cmd.extend([
-                    "--ssh-inject",
-                    f"root:string:{self.config['DEPLOY_KEY']}",
-                ])
-            logger.debug("Preparing machine %s.", name)
-            logged_cmd(prepare_cmd)
+            self.customize(domain, storage_pool, ready=kw.get('ready'))
 
         disk = self.create_disk(storage_pool, f'{name}-data', data_size_gb)
         self.attach_disk(domain, disk)
 
         return domain
 
+    def customize(self, domain, storage_pool, ready=None):
+        # ready is a ReadyEvent, flagged if guest will phone home.
+        name = domain.name()
+        url = phone_home_url(self.config, name)
+        if url and ready is not None:
+            ready.injected = True
+        if 'cloud-init' == self.config['LIBVIRT_CUSTOMIZATION']:
+            seed = self.create_seed(storage_pool, name)
+            self.attach_cdrom(domain, seed)
+            return
+
+        prepare_cmd = [
+            "virt-sysprep",
+            "--domain", name,
+            "--hostname", name,
+            "--selinux-relabel",
+        ]
+        if self.config['DEPLOY_KEY']:
+            prepare_cmd.extend([
+                "--ssh-inject",
+                f"root:string:{self.config['DEPLOY_KEY']}",
+            ])
+        if url:
+            prepare_cmd.extend([
+                "--firstboot-command", phone_home_command(url)])
+        logger.debug("Preparing machine %s.", name)
+        with TemporaryDirectory(prefix='cornac-helpers-') as tmpdir:
+            # Bake helpers in disk, saving a copy once booted.
+            extract_helpers(tmpdir)
+            prepare_cmd.extend(["--copy-in", f"{tmpdir}/usr:/"])
+            logged_cmd(prepare_cmd)
+
     def delete_machine(self, domain):
         try:
             domain = self._ensure_domain(domain)
@@ -164,6 +272,71 @@ class LibVirtIaaS(IaaS):
         state, _ = domain.state()
         return libvirt.VIR_DOMAIN_RUNNING == state
 
+    def iter_power_events(self):
+        events = queue.Queue()
+
+        def callback(conn, domain, event, detail, opaque):
+            name = domain.name()
+            if name == self.origin or not name.startswith(self.prefix):
+                return
+            if (libvirt.VIR_DOMAIN_EVENT_STOPPED == event and
+                    libvirt.VIR_DOMAIN_EVENT_STOPPED_CRASHED == detail):
+                event = libvirt.VIR_DOMAIN_EVENT_CRASHED
+            if event in POWER_EVENTS:
+                events.put((name[len(self.prefix):], POWER_EVENTS[event]))
+
+        callback_id = self.conn.domainEventRegisterAny(
+            None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, callback, None)
+        try:
+            while True:
+                try:
+                    yield events.get(timeout=5)
+                except queue.Empty:
+                    if not self.ping():
+                        raise Exception("Connection to libvirt lost.")
+        finally:
+            try:
+                self.conn.domainEventDeregisterAny(callback_id)
+            except libvirt.libvirtError as e:
+                logger.debug("Failed to deregister events callback: %s.", e)
+
+    def linked_clone(self, name):
+        # Define a new domain from origin with qcow2 overlays backed by origin
+        # disks. Origin disks must not change afterwards.
+        origin = self.conn.lookupByName(self.origin)
+        xml = ET.fromstring(origin.XMLDesc(libvirt.VIR_DOMAIN_XML_INACTIVE))
+        xml.find('./name').text = name
+        xml.remove(xml.find('./uuid'))
+        xos = xml.find('./os')
+        if xos.find('./nvram') is not None:
+            xos.remove(xos.find('./nvram'))
+        # Let libvirt generate new MAC addresses.
+        for xinterface in xml.findall('./devices/interface'):
+            if xinterface.find('./mac') is not None:
+                xinterface.remove(xinterface.find('./mac'))
+
+        xdisks = xml.findall("./devices/disk[@device='disk']")
+        for i, xdisk in enumerate(xdisks):
+            xsource = xdisk.find('./source')
+            backing = self.conn.storageVolLookupByPath(xsource.attrib['file'])
+            xbacking = ET.fromstring(backing.XMLDesc())
+            volname = f'{name}.qcow2' if 0 == i else f'{name}-{i}.qcow2'
+            logger.debug("Creating overlay %s of %s.", volname, backing.path())
+            pool = backing.storagePoolLookupByVolume()
+            overlay = pool.createXML(build_overlay_xml(
+                volname,
+                capacity=backing.info()[1],
+                backing=backing.path(),
+                backing_format=xbacking.find('./target/format').attrib['type'],
+            ))
+            xsource.attrib['file'] = overlay.path()
+            xdriver = xdisk.find('./driver')
+            if xdriver is not None:
+                xdriver.attrib['type'] = 'qcow2'
+
+        logger.debug("Defining machine %s.", name)
+        return self.conn.defineXML(ET.tostring(xml, encoding='unicode'))
+
     def list_machines(self):
         for domain in self.conn.listAllDomains():
             name = domain.name()
@@ -172,6 +345,25 @@ class LibVirtIaaS(IaaS):
             if name.startswith(self.prefix):
                 yield domain
 
+    def ping(self):
+        return 1 == self.conn.isAlive()
+
+    def power_states(self):
+        running = {
+            domain.name() for domain in
+            self.conn.listAllDomains(libvirt.VIR_CONNECT_LIST_DOMAINS_RUNNING)
+        }
+        return {
+            domain.name()[len(self.prefix):]: domain.name() in running
+            for domain in self.list_machines()
+        }
+
+    def rename_machine(self, domain, name):
+        domain = self._ensure_domain(domain)
+        logger.debug("Renaming %s as %s.", domain.name(), name)
+        domain.rename(self.machine_name(name), 0)
+        return domain
+
     def _ensure_domain(self, domain_or_name):
         if isinstance(domain_or_name, str):
             name = f"{self.prefix}{domain_or_name}"
@@ -185,14 +377,14 @@ class LibVirtIaaS(IaaS):
 
     def guess_data_device_in_guest(self, machine):
         # Guess /dev/disk/by-path/… device file from XML.
+        machine = self._ensure_domain(machine)
         xml = ET.fromstring(machine.XMLDesc())
-        name = f'{machine.name()}-data'
-        for xdisk in xml.findall(".//disk"):
-            if name in xdisk.find('./source').attrib['file']:
-                xdiskaddress = xdisk.find('./address')
-                break
-        else:
-            raise Exception(f"Can't find disk {name} in VM.")
+        # Data disk is attached right after system disk. Don't look it up by
+        # name: a renamed warm machine keeps its -warm-xxx-data volume.
+        xdisks = xml.findall("./devices/disk[@device='disk']")
+        if len(xdisks) < 2:
+            raise Exception(f"Can't find data disk in {machine.name()}.")
+        xdiskaddress = xdisks[1].find('./address')
 
         xcontrolleraddress = xml.find(
             ".//controller[@type='scsi']/address[@type='pci']")
@@ -235,12 +427,60 @@ class LibVirtIaaS(IaaS):
         if not wait:
             return
 
-        for _ in range(int(wait)):
-            state, _ = domain.state()
-            if wanted == state:
-                break
-            else:
-                sleep(1)
-            wait -= 1
-        else:
-            raise Timeout()
+        name = domain.name()
+        waiter = threading.Event()
+        with self.waiters_lock:
+            if self.waiters_callback is None:
+                self.waiters_callback = self.conn.domainEventRegisterAny(
+                    None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                    self.wake_waiters, None)
+            self.waiters.setdefault(name, set()).add(waiter)
+
+        deadline = monotonic() + wait
+        try:
+            while True:
+                # Check state after registering waiter to not miss an event.
+                state, _ = domain.state()
+                if wanted == state:
+                    return
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    raise Timeout()
+                # Poll state from time to time, in case an event is lost.
+                waiter.wait(min(remaining, 10))
+                waiter.clear()
+        finally:
+            with self.waiters_lock:
+                waiters = self.waiters[name]
+                waiters.discard(waiter)
+                if not waiters:
+                    del self.waiters[name]
+
+    def wake_waiters(self, conn, domain, event, detail, opaque):
+        # Called from event loop thread.
+        with self.waiters_lock:
+            for waiter in self.waiters.get(domain.name(), ()):
+                waiter.set()
+
+
+def build_volume_xml(name, capacity, format_='raw', allocation=None):
+    xvol = ET.Element('volume')
+    ET.SubElement(xvol, 'name').text = name
+    ET.SubElement(xvol, 'capacity').text = "%d" % capacity
+    if allocation is not None:
+        ET.SubElement(xvol, 'allocation').text = "%d" % allocation
+    xtarget = ET.SubElement(xvol, 'target')
+    ET.SubElement(xtarget, 'format', type=format_)
+    return ET.tostring(xvol, encoding='unicode')
+
+
+def build_overlay_xml(name, capacity, backing, backing_format):
+    xvol = ET.Element('volume')
+    ET.SubElement(xvol, 'name').text = name
+    ET.SubElement(xvol, 'capacity').text = "%d" % capacity
+    xtarget = ET.SubElement(xvol, 'target')
+    ET.SubElement(xtarget, 'format', type='qcow2')
+    xbacking = ET.SubElement(xvol, 'backingStore')
+    ET.SubElement(xbacking, 'path').text = backing
+    ET.SubElement(xbacking, 'format', type=backing_format)
+    return ET.tostring(xvol, encoding='unicode')
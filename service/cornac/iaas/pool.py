@@ -0,0 +1,143 @@
+#
+# Pool of IaaS sessions in worker process.
+#
+# Opening an IaaS session is expensive: a vCenter login takes seconds. Each
+# worker process keeps idle sessions for reuse by next tasks. A daemon thread
+# pings idle sessions to keep them alive and drops dead ones. After a failed
+# task, the session is checked too: a session with a broken connection or an
+# expired authentication is closed rather than reused. Next borrower then opens
+# a fresh session.
+#
+
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from time import monotonic, sleep
+
+from . import IaaS
+
+
+logger = logging.getLogger(__name__)
+
+
+class IaaSPool(object):
+    @classmethod
+    def for_app(cls, app):
+        if 'cornac.iaas_pool' not in app.extensions:
+            app.extensions['cornac.iaas_pool'] = cls(
+                app.config['IAAS'], app.config,
+                size=app.config['IAAS_POOL_SIZE'],
+                keepalive=app.config['IAAS_KEEPALIVE'],
+            )
+        return app.extensions['cornac.iaas_pool']
+
+    def __init__(self, url, config, size=4, keepalive=300,
+                 connect=IaaS.connect):
+        self.url = url
+        self.config = config
+        # Maximum number of idle sessions. 0 disables pooling.
+        self.size = size
+        # Seconds between health checks of idle sessions.
+        self.keepalive = keepalive
+        self.connect = connect
+        # Stack of idle sessions, as (last check time, session) tuples. Most
+        # recently used session is last.
+        self.idle = []
+        self.lock = threading.Lock()
+        # Sessions and keepalive thread don't survive fork. Track owner process
+        # to reset pool in children.
+        self.pid = None
+
+    @contextmanager
+    def borrow(self):
+        session = self.acquire()
+        try:
+            yield session
+        except Exception:
+            self.release(session, check=True)
+            raise
+        else:
+            self.release(session)
+
+    def acquire(self):
+        self.ensure_process()
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                checked, session = self.idle.pop()
+
+            # Keepalive thread may lag, check sessions not checked lately.
+            if monotonic() - checked < self.keepalive or self.check(session):
+                return session
+
+        logger.debug("Opening new IaaS session.")
+        return self.connect(self.url, self.config)
+
+    def release(self, session, check=False):
+        if check and not self.check(session):
+            return
+        with self.lock:
+            if self.pid == os.getpid() and len(self.idle) < self.size:
+                self.idle.append((monotonic(), session))
+                return
+        self.discard(session)
+
+    def check(self, session):
+        # Returns whether session is usable. Discards dead session.
+        try:
+            alive = session.ping()
+        except Exception as e:
+            logger.debug("IaaS session ping failed: %s.", e)
+            alive = False
+        if not alive:
+            logger.info("IaaS session is dead. Closing.")
+            self.discard(session)
+        return alive
+
+    def discard(self, session):
+        try:
+            session.close()
+        except Exception as e:
+            logger.debug("Failed to close IaaS session: %s.", e)
+
+    def ensure_process(self):
+        if self.pid == os.getpid():
+            return
+
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            # Forget parent sessions without closing them.
+            self.idle = []
+            if self.size and self.keepalive:
+                thread = threading.Thread(
+                    target=self.run, name='cornac-iaas-keepalive',
+                    daemon=True)
+                thread.start()
+
+    def run(self):
+        while True:
+            sleep(self.keepalive)
+            try:
+                self.ping_idle()
+            except Exception:
+                logger.exception("Unhandled error in IaaS keepalive:")
+
+    def ping_idle(self):
+        deadline = monotonic() - self.keepalive
+        with self.lock:
+            stale = [s for checked, s in self.idle if checked <= deadline]
+            self.idle = [(c, s) for c, s in self.idle if c > deadline]
+
+        for session in stale:
+            if self.check(session):
+                # Put back at bottom of the stack, most recently used sessions
+                # are preferred.
+                with self.lock:
+                    if len(self.idle) < self.size:
+                        self.idle.insert(0, (monotonic(), session))
+                        continue
+                self.discard(session)
@@ -7,7 +7,9 @@
 import logging
 import os.path
 from contextlib import contextmanager
+from functools import reduce
 from pathlib import Path
+from time import monotonic
 from urllib.parse import (
     parse_qs,
     urlparse,
@@ -29,6 +31,8 @@ from ..errors import (
     KnownError,
     RemoteCommandError,
 )
+from ..helpers import deploy_helpers
+from ..ready import phone_home_url, wait_ready
 from ..ssh import RemoteShell
 
 
@@ -57,6 +61,14 @@ retry_esx_connection = tenacity.retry(
 )
 
 
+# Maps VM power states to power events.
+POWER_EVENTS = {
+    'poweredOff': 'stopped',
+    'poweredOn': 'running',
+    'suspended': 'stopped',
+}
+
+
 class vCenter(IaaS):
     @classmethod
     def connect(cls, url, config):
@@ -77,6 +89,7 @@ class vCenter(IaaS):
         self.config = config
         # si stands for ServiceInstance.
         self.si = si
+        self._inventory = None
 
     @retry_esx_connection
     def clone_machine(self, origin, name, clonespec):
@@ -85,11 +98,26 @@ class vCenter(IaaS):
         return self.wait_task(task)
 
     def close(self):
+        if self._inventory:
+            try:
+                self._inventory.destroy()
+            except Exception as e:
+                logger.debug("Failed to destroy inventory collector: %s.", e)
         logger.debug("Disconnecting from vSphere.")
         Disconnect(self.si)
 
     def create_machine(
             self, name, storage_pool, data_size_gb=None, **kw):
+        if self.config['VCENTER_INSTANT_CLONE_PARENT']:
+            try:
+                return self.instant_clone(
+                    name, storage_pool, data_size_gb, ready=kw.get('ready'))
+            except KnownError:
+                raise
+            except Exception as e:
+                logger.warning(
+                    "Instant clone failed, falling back to clone: %s.", e)
+
         name = f"{self.prefix}{name}"
         logger.debug("Creating %s specification.", name)
         datastore = self.find(storage_pool)
@@ -132,9 +160,14 @@ class vCenter(IaaS):
 
     def endpoint(self, machine_or_name):
         machine = self._ensure_machine(machine_or_name)
-        return machine.name + self.config['DNS_DOMAIN']
+        return self.inventory.get(machine, 'name') + self.config['DNS_DOMAIN']
 
     def find(self, path):
+        try:
+            return self.inventory.find(path)
+        except KeyError:
+            # Inventory does not cache all types of objects, e.g. networks.
+            pass
         obj = self.si.content.searchIndex.FindByInventoryPath(path)
         if obj is None:
             raise KeyError(path)
@@ -146,22 +179,76 @@ class vCenter(IaaS):
         # https://communities.vmware.com/thread/298072
         return "/dev/sdb"
 
+    def iter_power_events(self):
+        # Subscribe to runtime.powerState of all VMs through a container view,
+        # with a dedicated collector to wait for updates without timeout.
+        PC = vmodl.query.PropertyCollector
+        content = self.si.content
+        view = content.viewManager.CreateContainerView(
+            content.rootFolder, [vim.VirtualMachine], True)
+        pc = content.propertyCollector.CreatePropertyCollector()
+        pc.CreateFilter(PC.FilterSpec(
+            objectSet=[PC.ObjectSpec(obj=view, skip=True, selectSet=[
+                PC.TraversalSpec(
+                    name='traverseView', path='view', skip=False,
+                    type=vim.view.ContainerView),
+            ])],
+            propSet=[PC.PropertySpec(
+                type=vim.VirtualMachine, all=False,
+                pathSet=['name', 'runtime.powerState'])],
+        ), partialUpdates=True)
+        options = PC.WaitOptions(maxWaitSeconds=60)
+        origin = os.path.basename(self.origin)
+        # VM names by managed object id. Updates only contain changes.
+        names = {}
+        version = ''
+        try:
+            while True:
+                update = pc.WaitForUpdatesEx(version, options=options)
+                if update is None:  # Timeout.
+                    continue
+                # First update is the current state, not an event.
+                initial = not version
+                version = update.version
+                for filter_ in update.filterSet:
+                    for change in filter_.objectSet:
+                        moid = change.obj._moId
+                        if 'leave' == change.kind:
+                            names.pop(moid, None)
+                            continue
+                        state = None
+                        for prop in change.changeSet:
+                            if 'name' == prop.name:
+                                names[moid] = prop.val
+                            elif 'runtime.powerState' == prop.name:
+                                state = prop.val
+                        name = names.get(moid, '')
+                        if initial or state is None or name == origin:
+                            continue
+                        if name.startswith(self.prefix):
+                            yield name[len(self.prefix):], POWER_EVENTS[state]
+        finally:
+            pc.DestroyPropertyCollector()
+            view.Destroy()
+
+    @property
+    def inventory(self):
+        if self._inventory is None:
+            self._inventory = Inventory(self.si.content)
+        return self._inventory
+
     def is_running(self, machine_or_name):
         machine = self._ensure_machine(machine_or_name)
-        return 'poweredOn' == machine.runtime.powerState
+        # Power state changes often, always fetch pending updates.
+        state = self.inventory.get(machine, 'runtime.powerState', fresh=True)
+        return 'poweredOn' == state
 
     def list_machines(self):
         origin = os.path.basename(self.origin)
-        for child in self.si.content.rootFolder.childEntity:
-            if not hasattr(child, 'vmFolder'):
-                continue
-
-            for machine in child.vmFolder.childEntity:
-                if origin == machine.name:
-                    continue
-
-                if machine.name.startswith(self.prefix):
-                    yield machine
+        for machine, props in self.inventory.list(vim.VirtualMachine):
+            name = props['name']
+            if name != origin and name.startswith(self.prefix):
+                yield machine
 
     def _ensure_machine(self, machine_or_name):
         if isinstance(machine_or_name, str):
@@ -185,6 +272,13 @@ class vCenter(IaaS):
             msg = f"{machine} tools at state {machine.guest.toolsStatus}."
             raise KnownError(msg)
 
+    @retry_esx_connection
+    def rename_machine(self, machine, name):
+        machine = self._ensure_machine(machine)
+        logger.debug("Renaming %s as %s.", machine, name)
+        self.wait_task(machine.Rename_Task(newName=self.machine_name(name)))
+        return machine
+
     @retry_esx_connection
     def start_machine(self, machine, wait_ssh=False, wait_tools=False):
         machine = self._ensure_machine(machine)
@@ -229,13 +323,98 @@ class vCenter(IaaS):
                 self._ensure_tools(machine)
                 machine.ShutdownGuest()
 
+    def instant_clone(self, name, storage_pool, data_size_gb, ready=None):
+        # Fork a frozen parent VM. The guest applies its identity from
+        # guestinfo once forked, see vhelper.sh freeze. Data disk is hot-added
+        # after fork. ready is an event set when guest phones home.
+        name = f"{self.prefix}{name}"
+        parent = self.ensure_parent()
+        datastore = self.find(storage_pool)
+
+        spec = vim.vm.InstantCloneSpec()
+        spec.name = name
+        spec.location = locspec = vim.vm.RelocateSpec()
+        locspec.datastore = datastore
+        locspec.folder = parent.parent
+        locspec.pool = self.find(self.config['VCENTER_RESOURCE_POOL'])
+        spec.config = [vim.option.OptionValue(
+            key='guestinfo.cornac.hostname', value=name)]
+        url = phone_home_url(self.config, name)
+        if url:
+            spec.config.append(vim.option.OptionValue(
+                key='guestinfo.cornac.ready-url', value=url))
+        logger.debug("Instant cloning %s as %s.", parent.name, name)
+        try:
+            machine = self.wait_task(parent.InstantClone_Task(spec=spec))
+        except vim.fault.DuplicateName:
+            raise KnownError(f"VM {name} already exists.")
+
+        try:
+            logger.debug("Adding data disk to %s.", name)
+            configspec = vim.vm.ConfigSpec()
+            configspec.deviceChange.append(
+                build_data_disk_spec(machine, datastore, name, data_size_gb))
+            self.wait_task(machine.ReconfigVM_Task(spec=configspec))
+            ssh = RemoteShell('root', self.endpoint(machine))
+            if url and ready is not None:
+                wait_ready(ready, probe=lambda: ssh(["true"]))
+            ssh.wait()
+            ssh(["/usr/local/bin/vhelper.sh", "rescan-disks"])
+        except Exception:
+            self.delete_machine(machine)
+            raise
+        if url and ready is not None:
+            # Don't flag a failed clone, fallback clone doesn't phone home.
+            ready.injected = True
+        return machine
+
+    def ensure_parent(self):
+        # Returns instant clone parent, frozen.
+        path = self.config['VCENTER_INSTANT_CLONE_PARENT'].format(
+            **self.config)
+        try:
+            parent = self.find(path)
+        except KeyError:
+            raise Exception(f"Instant clone parent {path} does not exist.")
+
+        if parent.runtime.instantCloneFrozen:
+            return parent
+
+        logger.info("Freezing instant clone parent %s.", parent.name)
+        self.start_machine(parent)
+        ssh = RemoteShell('root', self.endpoint(parent))
+        ssh.wait()
+        # Instant clones inherit helpers of parent.
+        deploy_helpers(ssh)
+        with self.wait_update(parent, 'runtime.instantCloneFrozen'):
+            # freeze blocks until VM resumes as a child. Detach it.
+            ssh([
+                "systemd-run", "--unit=cornac-freeze",
+                "/usr/local/bin/vhelper.sh", "freeze",
+            ])
+        if not parent.runtime.instantCloneFrozen:
+            raise Exception(f"Failed to freeze {parent.name}.")
+        return parent
+
+    def ping(self):
+        # Raises NotAuthenticated if session expired.
+        self.si.CurrentTime()
+        return True
+
+    def power_states(self):
+        self.inventory.refresh(force=True)
+        return {
+            self.inventory.get(machine, 'name')[len(self.prefix):]:
+            'poweredOn' == self.inventory.get(machine, 'runtime.powerState')
+            for machine in self.list_machines()
+        }
+
     def sysprep(self, machine):
         endpoint = self.endpoint(machine)
         logger.debug("Waiting for %s to come up.", endpoint)
         ssh = RemoteShell('root', endpoint)
         ssh.wait()
-        vhelper = str(Path(__file__).parent / 'vhelper.sh')
-        ssh.copy(vhelper, "/usr/local/bin/vhelper.sh")
+        deploy_helpers(ssh)
         logger.debug("Preparing system")
         ssh(["/usr/local/bin/vhelper.sh", "sysprep"])
 
@@ -284,6 +463,123 @@ class vCenter(IaaS):
             # Else, continue to wait.
 
 
+class Inventory(object):
+    # Cache of names, parents and power states of vCenter inventory.
+    #
+    # A dedicated PropertyCollector watches folders, datacenters, compute
+    # resources, resource pools, datastores and VMs. First WaitForUpdatesEx
+    # call retrieves the whole inventory in one traversal. Next calls with
+    # returned version fetch only changes since previous call. Inventory path
+    # of objects are built from name and parent properties. The collector of
+    # the session is left to iter_updates().
+
+    PROPERTIES = {
+        vim.ClusterComputeResource: ['name', 'parent'],
+        vim.ComputeResource: ['name', 'parent'],
+        vim.Datacenter: ['name', 'parent'],
+        vim.Datastore: ['name', 'parent'],
+        vim.Folder: ['name', 'parent'],
+        vim.ResourcePool: ['name', 'parent'],
+        vim.VirtualMachine: ['name', 'parent', 'runtime.powerState'],
+    }
+
+    def __init__(self, content, max_age=5):
+        self.content = content
+        # Seconds before polling vCenter for changes.
+        self.max_age = max_age
+        # Maps managed object id to object and cached properties.
+        self.objects = {}
+        # Maps inventory path to object. Built lazily.
+        self._paths = None
+        self.version = ''
+        self.polled = float('-inf')
+        logger.debug("Creating inventory property collector.")
+        self.pc = content.propertyCollector.CreatePropertyCollector()
+        self.pc.CreateFilter(
+            build_inventory_filter_spec(content.rootFolder, self.PROPERTIES),
+            partialUpdates=False,
+        )
+
+    def destroy(self):
+        self.pc.DestroyPropertyCollector()
+
+    def find(self, path):
+        self.refresh()
+        if path not in self.paths:
+            # Maybe a new object.
+            self.refresh(force=True)
+        return self.paths[path]
+
+    def get(self, obj, name, fresh=False):
+        self.refresh(force=fresh)
+        try:
+            return self.objects[obj._moId][1][name]
+        except KeyError:
+            pass
+        # Object is not yet known, fetch property on the object.
+        logger.debug("Inventory miss for %s.%s.", obj, name)
+        return reduce(getattr, name.split('.'), obj)
+
+    def list(self, type_):
+        # Yields objects of type and their properties.
+        self.refresh()
+        for obj, props in list(self.objects.values()):
+            if isinstance(obj, type_):
+                yield obj, props
+
+    def path(self, moid):
+        names = []
+        while moid in self.objects:
+            _, props = self.objects[moid]
+            parent = props.get('parent')
+            # Root folder is not part of inventory path.
+            if parent is None:
+                break
+            names.append(props['name'])
+            moid = parent._moId
+        return '/'.join(reversed(names))
+
+    @property
+    def paths(self):
+        if self._paths is None:
+            self._paths = {
+                self.path(moid): obj for moid, (obj, _) in self.objects.items()
+            }
+        return self._paths
+
+    def refresh(self, force=False):
+        if not force and monotonic() - self.polled < self.max_age:
+            return
+
+        # Don't wait for changes, return None if nothing changed.
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+        while True:
+            update = self.pc.WaitForUpdatesEx(self.version, options=options)
+            self.polled = monotonic()
+            if update is None:
+                break
+            self.apply(update)
+            self.version = update.version
+            if not update.truncated:
+                break
+
+    def apply(self, update):
+        for filter_ in update.filterSet:
+            for change in filter_.objectSet:
+                moid = change.obj._moId
+                if 'leave' == change.kind:
+                    self.objects.pop(moid, None)
+                else:
+                    _, props = self.objects.setdefault(moid, (change.obj, {}))
+                    for prop in change.changeSet:
+                        if 'assign' == prop.op:
+                            props[prop.name] = prop.val
+                        else:
+                            props.pop(prop.name, None)
+        # Names or parents may have changed.
+        self._paths = None
+
+
 def build_customization_spec():
     # To automatically set hostname, we need to create the minimal
     # customization spec which is no less than:
@@ -327,6 +623,44 @@ def build_data_disk_spec(origin, datastore, name, size_gb):
     return spec
 
 
+def build_inventory_filter_spec(root, properties):
+    # Traverse inventory tree from root folder, through datacenters folders,
+    # compute resources and nested resource pools.
+    PC = vmodl.query.PropertyCollector
+
+    def traversal(name, type_, path, *select):
+        return PC.TraversalSpec(
+            name=name, type=type_, path=path, skip=False,
+            selectSet=[PC.SelectionSpec(name=n) for n in select],
+        )
+
+    children = (
+        'folderChildren', 'datacenterVm', 'datacenterHost',
+        'datacenterDatastore', 'computeResourcePool',
+    )
+    traversals = [
+        traversal('folderChildren', vim.Folder, 'childEntity', *children),
+        traversal('datacenterVm', vim.Datacenter, 'vmFolder', *children),
+        traversal('datacenterHost', vim.Datacenter, 'hostFolder', *children),
+        traversal(
+            'datacenterDatastore', vim.Datacenter, 'datastoreFolder',
+            *children),
+        traversal(
+            'computeResourcePool', vim.ComputeResource, 'resourcePool',
+            'resourcePoolPools'),
+        traversal(
+            'resourcePoolPools', vim.ResourcePool, 'resourcePool',
+            'resourcePoolPools'),
+    ]
+    return PC.FilterSpec(
+        objectSet=[PC.ObjectSpec(obj=root, skip=False, selectSet=traversals)],
+        propSet=[
+            PC.PropertySpec(type=type_, all=False, pathSet=pathset)
+            for type_, pathset in properties.items()
+        ],
+    )
+
+
 def build_nic_spec(network):
     spec = vim.vm.device.VirtualDeviceSpec()
     spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
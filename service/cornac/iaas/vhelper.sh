@@ -13,6 +13,19 @@ _log() {
 	echo "$@" >&2
 }
 
+freeze() {
+	#: Freeze VM as instant clone parent. Customize VM once forked.
+
+	_log "Loading Postgres binaries in page cache."
+	cat /usr/pgsql-*/bin/* >/dev/null
+
+	_log "Freezing."
+	vmware-rpctool "instantclone.freeze"
+
+	# Now running in a fresh child.
+	post-fork
+}
+
 help() {
 	#: Show this message.
 
@@ -30,11 +43,41 @@ help() {
 }
 
 
+post-fork() {
+	#: Apply identity from guestinfo after instant clone.
+
+	local hostname=$(vmware-rpctool "info-get guestinfo.cornac.hostname")
+	_log "Setting hostname to ${hostname}."
+	hostnamectl set-hostname "${hostname}"
+
+	sysprep
+	systemd-machine-id-setup
+
+	_log "Renewing network configuration."
+	systemctl restart NetworkManager
+
+	local url=$(vmware-rpctool "info-get guestinfo.cornac.ready-url" 2>/dev/null ||:)
+	if [ -n "${url}" ] ; then
+		_log "Phoning home."
+		for i in $(seq 30) ; do
+			curl -fsS -X POST "${url}" && break
+			sleep 2
+		done
+	fi
+}
+
 pwgen() {
 	#: Generate a random password.
 	od -vN 16 -An -tx1 /dev/urandom | tr -d ' \n'
 }
 
+rescan-disks() {
+	#: Detect hot-added disks.
+	for host in /sys/class/scsi_host/host* ; do
+		echo "- - -" > $host/scan
+	done
+}
+
 sysprep() {
 	#: Refresh system after clone.
 
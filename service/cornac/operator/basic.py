@@ -6,9 +6,11 @@
 import logging
 import pdb
 import sys
-from pathlib import Path
+from contextlib import contextmanager
 
+from ..helpers import deploy_helpers
 from ..iaas import IaaS
+from ..ready import phone_home_url, wait_ready
 from ..ssh import Password, RemoteShell
 
 
@@ -20,60 +22,109 @@ class BasicOperator(object):
 
     helper = '/usr/local/bin/pghelper.sh'
 
-    def __init__(self, iaas, config):
+    def __init__(self, iaas, config, ready=None):
         self.iaas = iaas
         self.config = config
+        # ReadyWaiter receiving phone home of new machines, if any.
+        self.ready = ready
         # Configuration keys:
         #
         # original_machine: name of the template machine with Postgres.
 
-    def create_db_instance(self, command):
+    def create_db_instance(self, command, warm=None):
+        # Create a new machine or claim warm machine named warm.
         name = command['DBInstanceIdentifier']
-        machine = self.iaas.create_machine(
-            name=name,
-            storage_pool=self.config['STORAGE_POOL'],
-            data_size_gb=command['AllocatedStorage'],
-        )
-        self.iaas.start_machine(machine)
-        address = self.iaas.endpoint(machine)
-        shell = RemoteShell('root', address)
+        if warm:
+            machine = self.claim_machine(warm, name)
+        else:
+            machine = self.provision_machine(name, command['AllocatedStorage'])
+            self.prepare_instance(machine, command['EngineVersion'])
+        return self.configure_instance(machine, command)
+
+    def create_warm_machine(self, name, storage_pool, pgversion, size_gb):
+        # Provision a machine with Postgres instance, without database nor
+        # master user.
+        machine = self.provision_machine(name, size_gb, storage_pool)
+        self.prepare_instance(machine, pgversion)
+        return machine
+
+    def provision_machine(self, name, size_gb, storage_pool=None):
+        with self.expect_ready(name) as ready:
+            machine = self.iaas.create_machine(
+                name=name,
+                storage_pool=storage_pool or self.config['STORAGE_POOL'],
+                data_size_gb=size_gb,
+                ready=ready,
+            )
+            self.iaas.start_machine(machine)
+            shell = RemoteShell('root', self.iaas.endpoint(machine))
+            if ready is not None and ready.injected:
+                wait_ready(ready, probe=lambda: shell(["true"]))
         shell.wait()
-        logger.debug("Sending helper script.")
-        local_helper = str(Path(__file__).parent / 'pghelper.sh')
-        shell.copy(local_helper, self.helper)
+        deploy_helpers(shell)
+        return machine
+
+    @contextmanager
+    def expect_ready(self, name):
+        # Yields an event set when new machine phones home, or None if phone
+        # home is disabled.
+        name = self.iaas.machine_name(name)
+        if self.ready is None or not phone_home_url(self.config, name):
+            yield None
+        else:
+            with self.ready.expect(name) as event:
+                yield event
+
+    def prepare_instance(self, machine, pgversion):
+        shell = RemoteShell('root', self.iaas.endpoint(machine))
+        dev = self.iaas.guess_data_device_in_guest(machine)
+        # Helper reuses existing volumes and instance.
+        shell.batch([
+            [self.helper, "prepare-disk", dev],
+            [self.helper, "create-instance", pgversion],
+            [self.helper, "start"],
+        ])
 
-        # Formatting disk
+    def claim_machine(self, warm, name):
+        # Rename warm machine. Hostname is changed before reboot so that DHCP
+        # registers the new name in DNS.
+        logger.debug("Renaming warm machine %s to %s.", warm, name)
+        shell = RemoteShell('root', self.iaas.endpoint(warm))
         try:
-            # Check whether Postgres VG is configured.
-            shell(["test", "-d", "/dev/Postgres"])
+            # Warm machine may predate an upgrade of cornac.
+            deploy_helpers(shell)
+            shell([self.helper, "set-hostname", self.iaas.machine_name(name)])
+            self.iaas.stop_machine(warm)
+            self.iaas.rename_machine(warm, name)
         except Exception:
-            dev = self.iaas.guess_data_device_in_guest(machine)
-            shell([self.helper, "prepare-disk", dev])
-            shell([
-                self.helper, "create-instance",
-                command['EngineVersion'],
-                command['DBInstanceIdentifier'],
-            ])
-            shell([self.helper, "start"])
-        else:
-            logger.debug("Reusing Postgres instance.")
+            # Nothing would ever reference the warm machine. Don't leak it.
+            logger.debug("Deleting unclaimable warm machine %s.", warm)
+            try:
+                self.iaas.delete_machine(warm)
+            except Exception as e:
+                logger.error("Failed to delete %s: %s.", warm, e)
+            raise
+        self.iaas.start_machine(name)
+        return name
+
+    def configure_instance(self, machine, command):
+        name = command['DBInstanceIdentifier']
+        address = self.iaas.endpoint(machine)
+        shell = RemoteShell('root', address)
+        shell.wait()
 
-        # Master user
         master = command['MasterUsername']
-        shell([
-            self.helper,
-            "create-masteruser", master,
-            Password(command['MasterUserPassword']),
+        logger.debug("Creating master user and database %s.", name)
+        # Helper reuses existing database.
+        shell.batch([
+            [
+                self.helper,
+                "create-masteruser", master,
+                Password(command['MasterUserPassword']),
+            ],
+            [self.helper, "create-database", name, master],
         ])
 
-        # Creating database
-        bases = shell([self.helper, "psql", "-l"])
-        if f"\n {name} " in bases:
-            logger.debug("Reusing database %s.", name)
-        else:
-            logger.debug("Creating database %s.", name)
-            shell([self.helper, "create-database", name, master])
-
         return dict(
             Endpoint=dict(Address=address, Port=5432),
             DBInstanceIdentifier=name,
@@ -81,7 +132,10 @@ class BasicOperator(object):
 
     def is_running(self, machine):
         # Check whether *Postgres* is running.
-        address = self.iaas.endpoint(machine)
+        return self.probe(self.iaas.endpoint(machine))
+
+    def probe(self, address):
+        # Check whether Postgres on guest at address accepts SQL.
         shell = RemoteShell('root', address)
         try:
             shell([self.helper, "psql", "-l"])
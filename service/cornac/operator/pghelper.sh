@@ -49,6 +49,11 @@ create-database() {  #: <NAME> <OWNER> [CREATEDB_ARG ...]
 	#: Create database with some defaults.
 	local name=$1; shift
 	local owner=$1; shift
+
+	if psql -tc "SELECT 'EXISTS' FROM pg_database WHERE datname = '${name//\'/\'\'}';" | grep -q EXISTS ; then
+		_log "Reusing database ${name}."
+		return
+	fi
 	sudo -iu postgres createdb --locale en_US.UTF-8 -O "${owner}" "$@" "${name}"
 }
 
@@ -88,6 +93,10 @@ create-instance() {  #: <VERSION>
 
 	PGDATA=$(readlink -m ~postgres/managed/data_mnt/data)
 	PGWAL=$(readlink -m ~postgres/managed/wal_mnt/wal)
+	if [ -f $PGDATA/PG_VERSION ] ; then
+		_log "Reusing instance in $PGDATA."
+		return
+	fi
 	mkdir --parent $PGDATA $PGWAL
 	chown -R postgres: ~postgres/managed
 	sudo -iu postgres $bindir/initdb \
@@ -221,6 +230,11 @@ help() {
 prepare-disk() {  #: <DEVICE>
 	#: Partition, format and mount disk for managed instance.
 	local dev=$(readlink -m $1); shift
+	if [ -d /dev/Postgres ] ; then
+	    _log "Reusing Postgres volumes."
+	    return
+	fi
+
 	if ! [ -b "$dev" ] ; then
 	    _log "Disk $dev not found."
 	    return 1
@@ -277,6 +291,11 @@ psql() {  #: [PSQL_ARG ...]
 	sudo -iu postgres psql --no-password --set ON_ERROR_STOP=1 --quiet "$@"
 }
 
+set-hostname() {  #: <NAME>
+	#: Set static hostname of the guest.
+	hostnamectl set-hostname "$1"
+}
+
 start() {
 	#: Starts Postgres managed instance
 	systemctl start postgres-managed.service
@@ -0,0 +1,150 @@
+#
+# Pre-fork supervisor for bjoern.
+#
+# bjoern is single-threaded. To use all cores, the supervisor forks several
+# bjoern processes, each binding the same address with SO_REUSEPORT. The kernel
+# balances connections between them.
+#
+# On SIGINT, bjoern stops accepting connections and returns once in-flight
+# connections are closed. The supervisor relies on this to drain children. It
+# handles the following signals:
+#
+# - SIGTERM, SIGINT: drain children and exit.
+# - SIGHUP: rolling restart of children, one at a time.
+#
+# A child exiting without being asked to is respawned.
+#
+
+import logging
+import os
+import signal
+from time import monotonic, sleep
+
+from .web.metrics import Registry
+
+
+logger = logging.getLogger(__name__)
+
+
+class PreforkServer(object):
+    # Delay between respawn of children crashing at startup.
+    respawn_delay = 1
+
+    def __init__(self, app, host, port, workers, grace=30):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        # Time to wait for a child to drain its connections before killing
+        # it.
+        self.grace = grace
+        # Maps pid to start time and metrics slot.
+        self.children = {}
+        self.signals = []
+
+    def run(self):
+        # Allocate metrics slots for all workers, including new workers
+        # during rolling restart.
+        self.metrics = Registry.for_app(self.app, slots=2 * self.workers)
+
+        for signum in signal.SIGHUP, signal.SIGINT, signal.SIGTERM:
+            signal.signal(signum, self.on_signal)
+
+        logger.info("Starting %s workers.", self.workers)
+        for _ in range(self.workers):
+            self.spawn()
+
+        while True:
+            while self.signals:
+                signum = self.signals.pop(0)
+                if signal.SIGHUP == signum:
+                    self.restart()
+                else:
+                    return self.stop()
+            self.reap()
+            sleep(.2)
+
+    def on_signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def reap(self):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                break
+            child = self.children.pop(pid, None)
+            if child is None:
+                continue
+            started, _ = child
+            logger.warning(
+                "Worker %s exited unexpectedly with status %s.", pid, status)
+            if monotonic() - started < self.respawn_delay:
+                sleep(self.respawn_delay)
+            self.spawn()
+
+    def restart(self):
+        logger.info("Restarting workers.")
+        for pid in list(self.children):
+            new = self.spawn()
+            # Let new worker bind before removing old one.
+            sleep(.5)
+            waited, _ = os.waitpid(new, os.WNOHANG)
+            if waited:
+                del self.children[new]
+                logger.error("Failed to start new worker. Aborting restart.")
+                return
+            self.stop_child(pid)
+        logger.info("Workers restarted.")
+
+    def spawn(self):
+        used = {slot for _, slot in self.children.values()}
+        slot = min(set(range(self.metrics.slots)) - used)
+        pid = os.fork()
+        if pid:
+            logger.debug("Started worker %s.", pid)
+            self.children[pid] = monotonic(), slot
+            return pid
+
+        self.metrics.use_slot(slot)
+
+        # In child. Supervisor relays SIGTERM and SIGHUP as SIGINT.
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        exit_code = os.EX_SOFTWARE
+        try:
+            import bjoern
+
+            bjoern.run(self.app, self.host, self.port, reuse_port=True)
+        except KeyboardInterrupt:
+            exit_code = os.EX_OK
+        except Exception:
+            logger.exception("Unhandled error in worker:")
+        finally:
+            logging.shutdown()
+            os._exit(exit_code)
+
+    def stop(self):
+        logger.info("Draining workers.")
+        for pid in list(self.children):
+            self.stop_child(pid)
+        logger.info("All workers stopped.")
+
+    def stop_child(self, pid):
+        self.children.pop(pid, None)
+        try:
+            os.kill(pid, signal.SIGINT)
+        except ProcessLookupError:
+            return
+
+        deadline = monotonic() + self.grace
+        while monotonic() < deadline:
+            waited, _ = os.waitpid(pid, os.WNOHANG)
+            if waited:
+                logger.debug("Worker %s stopped.", pid)
+                return
+            sleep(.1)
+
+        logger.warning("Killing worker %s.", pid)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
@@ -0,0 +1,130 @@
+#
+# Wake up provisioning when a new guest is ready.
+#
+# On first boot, guests POST a token to cornac web at PHONE_HOME_URL. The token
+# is the machine name signed with HMAC of PHONE_HOME_SECRET. cornac web checks
+# the signature and notifies machine_ready channel with machine name. A worker
+# waiting for this machine wakes immediately instead of polling SSH. SSH
+# probes remain as a fallback, e.g. when guest can't reach cornac web or
+# notification is lost.
+#
+
+import hmac
+import logging
+import shlex
+import threading
+from contextlib import contextmanager
+from hashlib import sha256
+from time import monotonic
+
+from .core.listener import Listener
+from .errors import Timeout
+from .ssh import RETRY_DELAYS
+
+
+logger = logging.getLogger(__name__)
+CHANNEL = 'machine_ready'
+
+
+def sign(secret, name):
+    return hmac.new(
+        secret.encode('utf-8'), name.encode('utf-8'), sha256).hexdigest()
+
+
+def build_token(secret, name):
+    return f"{name}.{sign(secret, name)}"
+
+
+def check_token(secret, token):
+    # Returns machine name of a valid token, None otherwise.
+    name, _, signature = token.rpartition('.')
+    if name and hmac.compare_digest(signature, sign(secret, name)):
+        return name
+
+
+def phone_home_url(config, name):
+    # Returns URL where machine named name must POST on first boot, or None if
+    # phone home is disabled.
+    if not config['PHONE_HOME_URL'] or not config['PHONE_HOME_SECRET']:
+        return None
+    token = build_token(config['PHONE_HOME_SECRET'], name)
+    return f"{config['PHONE_HOME_URL'].rstrip('/')}/ready/{token}"
+
+
+def phone_home_command(url):
+    # Shell command for guest first boot. Waits for SSH to be up, then POST
+    # to url with retries.
+    url = shlex.quote(url)
+    return (
+        "until systemctl -q is-active sshd ; do sleep 1 ; done ; "
+        "for i in $(seq 30) ; do "
+        f"curl -fsS -X POST {url} && break ; sleep 2 ; "
+        "done"
+    )
+
+
+class ReadyEvent(threading.Event):
+    # Set when machine phones home. IaaS provider flags injected when it
+    # configured guest to phone home. Otherwise, waiting is pointless.
+    injected = False
+
+
+class ReadyWaiter(object):
+    # Dispatch machine_ready notifications to waiting threads.
+
+    @classmethod
+    def for_app(cls, app):
+        if 'cornac.ready' not in app.extensions:
+            app.extensions['cornac.ready'] = cls(Listener.for_app(app))
+        return app.extensions['cornac.ready']
+
+    def __init__(self, listener):
+        self.listener = listener
+        self.events = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def expect(self, name):
+        # Yields an event set when machine name phones home. Enter before
+        # booting the machine to not miss the notification.
+        event = ReadyEvent()
+        with self.lock:
+            self.events[name] = event
+        self.listener.subscribe(CHANNEL, self.notify)
+        try:
+            yield event
+        finally:
+            with self.lock:
+                self.events.pop(name, None)
+
+    def notify(self, payload):
+        if payload is None:
+            # Notifications may have been missed. SSH probes will catch up.
+            return
+        with self.lock:
+            event = self.events.get(payload)
+        if event:
+            logger.debug("%s phoned home.", payload)
+            event.set()
+
+
+def wait_ready(event, probe, timeout=300, delays=RETRY_DELAYS):
+    # Wait for event, calling probe as a fallback after each of delays
+    # seconds, like remote_retry. Last delay repeats. probe raises an
+    # exception if guest is not ready. Probe first, guest may be ready before
+    # waiting.
+    deadline = monotonic() + timeout
+    delays = iter(delays)
+    delay = None
+    while not event.is_set():
+        try:
+            probe()
+        except Exception as e:
+            logger.debug("Guest is not ready: %s.", e)
+        else:
+            return logger.debug("Guest is ready without phoning home.")
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            raise Timeout("Guest is not ready.")
+        delay = next(delays, delay)
+        event.wait(min(delay, remaining))
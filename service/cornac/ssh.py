@@ -1,7 +1,16 @@
+import atexit
+import hashlib
 import logging
+import multiprocessing.util
+import os
 import shlex
+import shutil
 import socket
 import subprocess
+import tempfile
+import threading
+from base64 import b64decode
+from collections import namedtuple
 from random import randint
 
 import tenacity
@@ -10,26 +19,32 @@ from .errors import RemoteCommandError
 
 
 logger = logging.getLogger(__name__)
+# Prefix of lines reporting result of a batch step.
+BATCH_MARKER = 'cornac-batch-step'
+BatchStep = namedtuple(
+    'BatchStep', 'command exit_code stdout stderr duration')
 
 
-def logged_cmd(cmd, *a, **kw):
+def logged_cmd(cmd, *a, input=None, **kw):
+    # input is bytes sent to command stdin.
     logger.debug("Running %s", ' '.join([shlex.quote(str(i)) for i in cmd]))
     # Unpack passwords now that command is logged.
     cmd = [a.password if isinstance(a, Password) else a for a in cmd]
+    if input is not None:
+        kw['stdin'] = subprocess.PIPE
     child = subprocess.Popen(
         cmd, *a, **kw,
         stderr=subprocess.PIPE, stdout=subprocess.PIPE,
     )
-    err = []
-    for line in child.stderr:
-        line = line.strip().decode('utf-8')
-        err.append(line)
+    # Read both pipes while feeding stdin, a full pipe would block child.
+    out, err = child.communicate(input)
+    out = out.decode('utf-8')
+    err = [line.strip() for line in err.decode('utf-8').splitlines()]
+    for line in err:
         logger.debug("<<< %s", line)
-    out = child.stdout.read().decode('utf-8')
-    returncode = child.wait()
-    if returncode != 0:
+    if child.returncode != 0:
         raise subprocess.CalledProcessError(
-            returncode=returncode,
+            returncode=child.returncode,
             cmd=cmd,
             output=out,
             stderr='\n'.join(err),
@@ -37,9 +52,11 @@ def logged_cmd(cmd, *a, **kw):
     return out
 
 
+# Seconds between attempts to reach a booting guest. Last delay repeats.
+RETRY_DELAYS = range(12, 1, -1)
 remote_retry = tenacity.retry(
     wait=tenacity.wait_chain(*[
-        tenacity.wait_fixed(i) for i in range(12, 1, -1)
+        tenacity.wait_fixed(i) for i in RETRY_DELAYS
     ]),
     retry=(tenacity.retry_if_exception_type(RemoteCommandError) |
            tenacity.retry_if_exception_type(OSError)),
@@ -69,6 +86,123 @@ class Password(object):
         return '********'
 
 
+class ControlMasters(object):
+    # Share one SSH connection per host between ssh and scp processes of
+    # current process, using OpenSSH ControlMaster. Masters exit after persist
+    # seconds idle or when process exits. persist None or 0 disables
+    # multiplexing.
+    #
+    # cornac starts masters explicitly in background, without pipes. A master
+    # started by ControlMaster=auto would inherit stderr pipe of logged_cmd and
+    # keep it open.
+
+    def __init__(self, persist=None):
+        self.persist = persist
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.dir = None
+        self.pid = None
+
+    def options(self, user, host):
+        # Returns ssh options to reuse master connection to host, starting
+        # master if needed.
+        if not self.persist:
+            return []
+
+        with self.lock:
+            if self.pid != os.getpid():
+                # Don't share masters with parent process.
+                self.dir = tempfile.mkdtemp(prefix='cornac-ssh-')
+                self.pid = os.getpid()
+                self.locks = {}
+                atexit.register(self.close, self.dir, self.pid)
+                # Processes of multiprocessing, like dramatiq workers, exit
+                # with os._exit(), skipping atexit. multiprocessing runs
+                # finalizers instead.
+                multiprocessing.util.Finalize(
+                    None, self.close, args=(self.dir, self.pid),
+                    exitpriority=10)
+            # Hash to keep socket path below sun_path limit.
+            key = hashlib.sha1(f"{user}@{host}".encode('utf-8')).hexdigest()
+            path = os.path.join(self.dir, key[:16])
+            lock = self.locks.setdefault(path, threading.Lock())
+
+        with lock:
+            if os.path.exists(path) and not self.check(host, path):
+                # Master died, e.g. guest rebooted. Drop its stale socket.
+                logger.debug("SSH master connection to %s is gone.", host)
+                os.unlink(path)
+            if not os.path.exists(path):
+                self.start(user, host, path)
+
+        # If master failed to start, ssh connects directly.
+        return ["-o", "ControlMaster=no", "-o", f"ControlPath={path}"]
+
+    def check(self, host, path):
+        # Returns whether master behind socket path is alive.
+        try:
+            proc = subprocess.run(
+                ["ssh", "-q", "-o", f"ControlPath={path}", "-O", "check",
+                 host],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=10,
+            )
+        except subprocess.TimeoutExpired:
+            return False
+        return 0 == proc.returncode
+
+    def start(self, user, host, path):
+        logger.debug("Starting SSH master connection to %s.", host)
+        try:
+            subprocess.run(
+                ["ssh", "-q", "-l", user, host] + RemoteShell.ssh_options + [
+                    "-o", "ConnectTimeout=10",
+                    "-o", "ControlMaster=yes",
+                    "-o", f"ControlPath={path}",
+                    "-o", f"ControlPersist={self.persist}",
+                    # Detect dead guest instead of hanging clients.
+                    "-o", "ServerAliveInterval=15",
+                    "-o", "ServerAliveCountMax=3",
+                    # Go to background after authentication, without command.
+                    "-f", "-N",
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=30,
+            )
+        except subprocess.TimeoutExpired:
+            logger.debug("Timeout starting SSH master connection to %s.", host)
+
+    def close(self, dir_, pid):
+        # Ask masters to exit and remove their sockets.
+        if pid != os.getpid():
+            # Forked process exiting, masters belong to parent.
+            return
+        if not os.path.isdir(dir_):
+            # Already closed by atexit or multiprocessing finalizer.
+            return
+
+        for name in os.listdir(dir_):
+            try:
+                subprocess.run(
+                    ["ssh", "-q", "-o", f"ControlPath={dir_}/{name}",
+                     "-O", "exit", "cornac"],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=5,
+                )
+            except Exception as e:
+                logger.debug("Failed to stop SSH master: %s.", e)
+        shutil.rmtree(dir_, ignore_errors=True)
+
+
+control_masters = ControlMasters()
+
+
 class RemoteShell(object):
     ssh_options = [
         # For now, just accept any key from remote hosts.
@@ -77,19 +211,22 @@ class RemoteShell(object):
     ]
 
     def __init__(self, user, host):
+        self.user = user
+        self.host = host
         self.ssh = ["ssh", "-q", "-l", user, host]
         self.scp_target_prefix = f"{user}@{host}:"
 
-    def __call__(self, command):
+    def __call__(self, command, input=None):
         try:
             return logged_cmd(
-                self.ssh + self.ssh_options +
+                self.ssh + self.options() +
                 [
                     Password(shlex.quote(i.password))
                     if isinstance(i, Password) else
                     shlex.quote(i)
                     for i in command
                 ],
+                input=input,
             )
         except subprocess.CalledProcessError as e:
             # SSH shows commands stderr in stdout and SSH client logs in
@@ -104,15 +241,81 @@ class RemoteShell(object):
                 exit_code=e.returncode,
                 ssh_logs=e.stderr)
 
+    def batch(self, commands):
+        # Run commands in order in a single SSH session, stopping at first
+        # failure. The script is sent on stdin, thus passwords don't appear in
+        # process list. Each step reports exit code, duration in nanoseconds
+        # and base64-encoded output on a single line. Returns a list of
+        # BatchStep. Raises RemoteCommandError on first failing step.
+        script = [
+            'tmp=$(mktemp -d)',
+            "trap 'rm -rf $tmp' EXIT",
+        ]
+        for i, command in enumerate(commands):
+            logger.debug(
+                "Batching %s",
+                ' '.join([shlex.quote(str(a)) for a in command]))
+            line = ' '.join([
+                shlex.quote(a.password if isinstance(a, Password) else a)
+                for a in command
+            ])
+            script.extend([
+                'start=$(date +%s%N)',
+                # Don't let command read script from stdin.
+                f'{line} </dev/null >$tmp/out 2>$tmp/err',
+                'rc=$?',
+                'end=$(date +%s%N)',
+                f'echo "{BATCH_MARKER} {i} $rc $((end - start))'
+                ' $(base64 -w0 <$tmp/out) $(base64 -w0 <$tmp/err)"',
+                '[ $rc -eq 0 ] || exit 0',
+            ])
+        out = self(["bash", "-s"], input='\n'.join(script).encode('utf-8'))
+
+        steps = []
+        for line in out.splitlines():
+            if not line.startswith(BATCH_MARKER + ' '):
+                continue
+            _, i, exit_code, duration, stdout, stderr = line.split(' ')
+            step = BatchStep(
+                command=commands[int(i)],
+                exit_code=int(exit_code),
+                stdout=b64decode(stdout).decode('utf-8', 'replace'),
+                stderr=b64decode(stderr).decode('utf-8', 'replace'),
+                duration=int(duration) / 1e9,
+            )
+            steps.append(step)
+            for errline in step.stderr.splitlines():
+                logger.debug("<<< %s", errline)
+            logger.debug(
+                "Step %s exited with code %s in %.3fs.",
+                i, step.exit_code, step.duration)
+            if step.exit_code:
+                message = step.stderr or step.stdout
+                raise RemoteCommandError(
+                    message=message.splitlines()[-1]
+                    if message else "Unknown error.",
+                    exit_code=step.exit_code,
+                    ssh_logs=step.stderr)
+
+        if len(steps) != len(commands):
+            raise RemoteCommandError(
+                message=f"Batch interrupted after {len(steps)} steps.",
+                exit_code=None,
+                ssh_logs='')
+        return steps
+
     def copy(self, src, dst):
         try:
             return logged_cmd(
-                ["scp"] + self.ssh_options +
+                ["scp"] + self.options() +
                 [src, self.scp_target_prefix + dst]
             )
         except subprocess.CalledProcessError as e:
             raise Exception(e.stderr)
 
+    def options(self):
+        return self.ssh_options + control_masters.options(self.user, self.host)
+
     @remote_retry
     def wait(self):
         # Just ping with true to trigger SSH. This method allows Host rewrite
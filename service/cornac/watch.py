@@ -0,0 +1,67 @@
+#
+# Update inventory from IaaS power events.
+#
+# cornac watch follows power state changes of machines, e.g. a manual power off
+# or a hypervisor crash, and updates instance status within seconds. Postgres
+# state is unknown when a machine powers on, worker inspects such instance.
+# Events are lost while disconnected from IaaS. Thus each connection triggers
+# an inspection of all instances.
+#
+
+import logging
+from time import sleep
+
+from . import worker
+from .core.model import DBInstance, db
+from .iaas import IaaS
+
+
+logger = logging.getLogger(__name__)
+
+
+def watch(config, reconnect_delay=5):
+    while True:
+        try:
+            with IaaS.connect(config['IAAS'], config) as iaas:
+                logger.info("Watching IaaS power events.")
+                worker.inspect_instances.send()
+                for identifier, event in iaas.iter_power_events():
+                    handle_power_event(identifier, event)
+        except Exception as e:
+            logger.warning("Lost IaaS power events: %s.", e)
+        finally:
+            db.session.remove()
+        sleep(reconnect_delay)
+
+
+def handle_power_event(identifier, event):
+    instance = (
+        DBInstance.query
+        .filter(DBInstance.identifier == identifier)
+        .one_or_none())
+    if instance is None:
+        return logger.debug("Ignoring unknown machine %s.", identifier)
+
+    logger.info("%s is %s.", instance, event)
+    status = power_event_status(instance.status, event)
+    if status and status != (instance.status, instance.status_message):
+        db.session.execute(worker.build_status_update({instance.id: status}))
+    elif 'running' == event and instance.status in ('failed', 'stopped'):
+        logger.debug("Queuing inspection of %s.", instance)
+        worker.inspect_instances.send([instance.id])
+    db.session.commit()
+
+
+def power_event_status(status, event):
+    # Translate a power event in status and status message of an instance.
+    # Returns None if status is unchanged or must be inspected.
+    if status not in worker.INSPECTABLE_STATUSES:
+        # A task is managing the instance, e.g. stopping it.
+        return None
+    elif 'crashed' == event:
+        return 'failed', 'VM crashed.'
+    elif 'stopped' == event:
+        return 'stopped', None
+    else:
+        # Postgres state is unknown.
+        return None
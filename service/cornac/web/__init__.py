@@ -1,6 +1,8 @@
 from flask import current_app, make_response, request
 
+from .metrics import blueprint as metrics
 from .rds import blueprint as rds
+from .ready import blueprint as ready
 
 
 def fallback(e):
@@ -11,4 +13,4 @@ def fallback(e):
     return make_response('Not Found', 404)
 
 
-__all__ = ['fallback', 'rds']
+__all__ = ['fallback', 'metrics', 'rds', 'ready']
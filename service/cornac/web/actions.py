@@ -4,10 +4,10 @@
 # XML snippet.
 
 import logging
+import re
 from datetime import datetime
-from textwrap import dedent
-
-from jinja2 import Template
+from sqlalchemy import or_
+from sqlalchemy.orm import load_only
 from sqlalchemy.orm.exc import NoResultFound
 from sqlalchemy.exc import IntegrityError
 
@@ -15,8 +15,9 @@ from . import (
     errors,
     xml,
 )
+from .cache import get_describe_cache
 from .. import worker
-from ..core.model import DBInstance, db
+from ..core.model import DBInstance, DBInstanceStatus, db
 
 
 logger = logging.getLogger(__name__)
@@ -74,23 +75,132 @@ def DeleteDBInstance(*, DBInstanceIdentifier, **command):
     return xml.InstanceEncoder(instance).as_xml()
 
 
-INSTANCE_LIST_TMPL = Template(dedent("""\
-<DBInstances>
-{% for instance in instances %}
-  {{ instance.as_xml() | indent(2) }}
-{% endfor %}
-</DBInstances>
-"""), trim_blocks=True)
+def parse_pagination(command, default=100, min_=20, max_=100):
+    # Validate MaxRecords and Marker parameters of Describe* actions. Marker
+    # is the last id of previous page, used as key for keyset pagination.
+    try:
+        limit = int(command.get('MaxRecords', default))
+    except ValueError:
+        raise errors.InvalidParameterValue("MaxRecords must be an integer.")
+    if not min_ <= limit <= max_:
+        raise errors.InvalidParameterValue(
+            f"MaxRecords must be between {min_} and {max_}.")
+
+    marker = command.get('Marker')
+    if marker is not None:
+        try:
+            marker = int(marker)
+        except ValueError:
+            raise errors.InvalidParameterValue(f"Invalid Marker {marker}.")
+    return limit, marker
+
+
+def data_contains(key):
+    # Build a predicate factory for a data key. Containment is served by the
+    # GIN index on data.
+    def predicate(values):
+        return or_(*(DBInstance.data.contains({key: v}) for v in values))
+    return predicate
+
+
+def status_in(values):
+    unknown = set(values) - set(DBInstanceStatus.enums)
+    if unknown:
+        raise errors.InvalidParameterValue(
+            f"Unknown status {', '.join(sorted(unknown))}.")
+    return DBInstance.status.in_(values)
+
+
+# Maps RDS filter names to SQL predicates on DBInstance.
+FILTERS = {
+    # Accept either identifier or ARN, like RDS.
+    'db-instance-id': lambda values: DBInstance.identifier.in_(
+        [v.rpartition(':')[2] for v in values]),
+    'db-instance-status': status_in,
+    'engine': data_contains('Engine'),
+    'engine-version': data_contains('EngineVersion'),
+}
+_filter_key_re = re.compile(
+    r'Filters\.Filter\.(\d+)\.(?:(Name)|Values\.Value\.(\d+))$')
+
+
+def parse_filters(command):
+    # Collect Filters.Filter.N.Name and Filters.Filter.N.Values.Value.M
+    # parameters as a list of (name, values) tuples.
+    filters = {}
+    for key, value in command.items():
+        match = _filter_key_re.match(key)
+        if not match:
+            continue
+        n, is_name, m = match.groups()
+        name, values = filters.get(int(n), (None, {}))
+        if is_name:
+            name = value
+        else:
+            values[int(m)] = value
+        filters[int(n)] = name, values
+
+    parsed = []
+    for n, (name, values) in sorted(filters.items()):
+        if name is None:
+            raise errors.InvalidParameterValue(
+                f"Filter {n} requires a Name.")
+        if name not in FILTERS:
+            raise errors.InvalidParameterValue(
+                f"Unrecognized filter name: {name}.")
+        if not values:
+            raise errors.InvalidParameterValue(
+                f"Filter {name} requires at least one value.")
+        parsed.append((name, [v for _, v in sorted(values.items())]))
+    return parsed
+
+
+def filter_instances(qry, filters):
+    for name, values in filters:
+        qry = qry.filter(FILTERS[name](values))
+    return qry
 
 
 def DescribeDBInstances(**command):
-    qry = DBInstance.query
+    limit, marker = parse_pagination(command)
+    filters = parse_filters(command)
+
+    cache = get_describe_cache()
+    if cache is not None:
+        key = ('DescribeDBInstances',) + tuple(sorted(command.items()))
+        fragments = cache.get(key)
+        if fragments is not None:
+            return fragments
+        generation = cache.generation
+
+    qry = (
+        DBInstance.query
+        # Load only columns used by InstanceEncoder.
+        .options(load_only('id', 'identifier', 'status', 'data'))
+        .order_by(DBInstance.id)
+    )
     if 'DBInstanceIdentifier' in command:
         qry = qry.filter(
             DBInstance.identifier == command['DBInstanceIdentifier'])
-    instances = qry.all()
-    return INSTANCE_LIST_TMPL.render(
-        instances=[xml.InstanceEncoder(i) for i in instances])
+    qry = filter_instances(qry, filters)
+    if marker is not None:
+        qry = qry.filter(DBInstance.id > marker)
+    # Fetch one more row to know whether there is a next page.
+    instances = qry.limit(limit + 1).all()
+    if len(instances) > limit:
+        instances = instances[:limit]
+        marker = instances[-1].id
+    else:
+        marker = None
+    fragments = xml.iter_list_xml(
+        'DBInstances',
+        (xml.InstanceEncoder(i) for i in instances),
+        marker=marker,
+    )
+    if cache is not None:
+        fragments = list(fragments)
+        cache.set(key, fragments, generation)
+    return fragments
 
 
 def RebootDBInstance(*, DBInstanceIdentifier):
@@ -1,23 +1,26 @@
 import copy
+import hashlib
+import hmac
 import logging
 import re
-from datetime import datetime
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from urllib.parse import quote
 
-from botocore.auth import SigV4Auth, SIGV4_TIMESTAMP, ISO8601
-from botocore.awsrequest import AWSRequest
-from botocore.credentials import Credentials
 from flask import current_app
 from werkzeug.urls import url_encode
 
 from . import errors
+from .credentials import get_credentials
 
 
 logger = logging.getLogger(__name__)
+SIGV4_TIMESTAMP = '%Y%m%dT%H%M%SZ'
 
 
 def authenticate(request, credentials=None):
     if credentials is None:
-        credentials = current_app.config['CREDENTIALS']
+        credentials = get_credentials()
 
     try:
         authorization = request.headers['Authorization']
@@ -47,7 +50,6 @@ def authenticate(request, credentials=None):
 
 def check_request_signature(request, authorization, secret_key,
                             region='local'):
-    # Reuse botocore API to validate signature.
     if 'AWS4-HMAC-SHA256' != authorization.algorithm:
         raise errors.IncompleteSignature(
             f"Unsupported AWS 'algorithm': '{authorization.algorithm}'")
@@ -69,14 +71,10 @@ def check_request_signature(request, authorization, secret_key,
                 f"Authorization header requires existence of '{h}' header. "
                 f"{authorization}")
 
-    creds = Credentials(authorization.access_key, secret_key)
-    signer = SigV4Auth(creds, 'rds', region)
-    awsrequest = make_boto_request(request, headers_to_sign)
-    canonical_request = signer.canonical_request(awsrequest)
-    string_to_sign = signer.string_to_sign(awsrequest, canonical_request)
-    signature = signer.signature(string_to_sign, awsrequest)
+    signature = compute_signature(
+        request, authorization, secret_key, region=region)
 
-    if signature != authorization.signature:
+    if not hmac.compare_digest(signature, authorization.signature):
         raise errors.SignatureDoesNotMatch(description=(
             "The request signature we calculated does not match the signature "
             "you provided. Check your AWS Secret Access Key and signing "
@@ -84,39 +82,80 @@ def check_request_signature(request, authorization, secret_key,
         ))
 
 
-def make_boto_request(request, headers_to_sign=None):
-    # Adapt a Flask request object to AWSRequest.
-
-    if headers_to_sign is None:
-        headers_to_sign = [h.lower() for h in request.headers.keys()]
-    headers = {
-        k: v for k, v in request.headers.items()
-        if k.lower() in headers_to_sign}
-
-    awsrequest = AWSRequest(
-        method=request.method,
-        url=request.url,
-        headers=headers,
-        # Re-encode back form data. Flask loose it :/ We may want to subclass
-        # Flask/Werkzeug Request class to keep the raw_data value before
-        # decoding form-data. Say, only if content-length is below 1024 bytes.
-        data=url_encode(request.form, 'utf-8'),
-    )
-
+def compute_signature(request, authorization, secret_key, region='local',
+                      service='rds'):
+    # Implements AWS Signature Version 4 on Flask request. cf.
+    # https://docs.aws.amazon.com/general/latest/gr/sigv4_signing.html
+    timestamp = get_timestamp(request)
+    date = timestamp[:8]
+    canonical_request = make_canonical_request(
+        request, authorization.signed_headers)
+    string_to_sign = '\n'.join([
+        'AWS4-HMAC-SHA256',
+        timestamp,
+        f'{date}/{region}/{service}/aws4_request',
+        hashlib.sha256(canonical_request.encode('utf-8')).hexdigest(),
+    ])
+    key = derive_signing_key(
+        authorization.access_key, secret_key, date, region, service)
+    return hmac.new(
+        key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _hmac_sha256(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256).digest()
+
+
+# Signing key only changes daily. Keep secret key in cache key so that a
+# rotated secret never reuses a stale signing key.
+@lru_cache(maxsize=1024)
+def derive_signing_key(access_key, secret_key, date, region, service):
+    key = _hmac_sha256(('AWS4' + secret_key).encode('utf-8'), date)
+    key = _hmac_sha256(key, region)
+    key = _hmac_sha256(key, service)
+    return _hmac_sha256(key, 'aws4_request')
+
+
+def make_canonical_request(request, signed_headers):
+    # Mimic botocore canonical request, from raw request body.
+    headers = []
+    for name in sorted(set(signed_headers)):
+        values = request.headers.getlist(name)
+        value = ','.join(' '.join(v.split()) for v in values)
+        headers.append(f'{name}:{value}')
+
+    query = request.query_string.decode('utf-8')
+    if query:
+        pairs = sorted(p.partition('=')[::2] for p in query.split('&'))
+        query = '&'.join(f'{k}={v}' for k, v in pairs)
+
+    body = request.get_data()
+    if not body and request.form:
+        # Form has been parsed before body was cached. Re-encode it.
+        body = url_encode(request.form, 'utf-8').encode('utf-8')
+
+    return '\n'.join([
+        request.method,
+        quote(request.path or '/', safe='/~'),
+        query,
+        '\n'.join(headers) + '\n',
+        ';'.join(sorted(set(signed_headers))),
+        hashlib.sha256(body).hexdigest(),
+    ])
+
+
+def get_timestamp(request):
     # Get sig timestamp from headers.
     if 'x-amz-date' in request.headers:
-        timestamp = request.headers['X-Amz-Date']
+        return request.headers['X-Amz-Date']
     elif 'date' in request.headers:
-        date = datetime.strptime(ISO8601, request.headers['Date'])
-        timestamp = date.strftime(SIGV4_TIMESTAMP, date)
+        date = parsedate_to_datetime(request.headers['Date'])
+        return date.strftime(SIGV4_TIMESTAMP)
     else:
         raise errors.IncompleteSignature(
             "Authorization header requires existence of either "
             "'X-Amz-Date' or 'Date' header. "
             f"{request.headers['Authorization']}")
-    awsrequest.context['timestamp'] = timestamp
-
-    return awsrequest
 
 
 class Authorization(object):
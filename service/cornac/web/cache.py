@@ -0,0 +1,65 @@
+#
+# Cache Describe* responses in memory.
+#
+# db_instances trigger NOTIFY on each change. Each process listens to these
+# notifications and flushes the whole cache. The cache is bypassed when the
+# listener is not connected, so a response is never served stale for longer
+# than notification latency.
+#
+
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+
+from ..core.listener import Listener
+
+
+class ResponseCache(object):
+    # LRU cache guarded by a generation counter. A result computed while the
+    # cache has been invalidated is not stored.
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            try:
+                self.entries.move_to_end(key)
+            except KeyError:
+                return None
+            return self.entries[key]
+
+    def set(self, key, value, generation):
+        with self.lock:
+            if generation != self.generation:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, payload=None):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+
+def get_describe_cache(channel='db_instances'):
+    # Returns cache if usable, None otherwise.
+    app = current_app._get_current_object()
+    size = app.config['DESCRIBE_CACHE_SIZE']
+    if not size:
+        return None
+
+    if 'cornac.describe_cache' not in app.extensions:
+        app.extensions['cornac.describe_cache'] = ResponseCache(size)
+    cache = app.extensions['cornac.describe_cache']
+    listener = Listener.for_app(app)
+    listener.subscribe(channel, cache.invalidate)
+    if not listener.is_listening(channel):
+        return None
+    return cache
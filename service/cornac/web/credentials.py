@@ -0,0 +1,72 @@
+#
+# Cache of RDS API credentials.
+#
+# Credentials are stored in credentials table. Each web process loads the
+# whole table in a dict and reloads it when the table notifies a change. While
+# not listening to notifications, each lookup queries the database.
+#
+# Credentials from CREDENTIALS setting are still honored.
+#
+
+import threading
+
+from flask import current_app
+
+from ..core.listener import Listener
+from ..core.model import Credential, db
+
+
+class CredentialStore(object):
+    channel = 'credentials'
+
+    @classmethod
+    def for_app(cls, app):
+        if 'cornac.credentials' not in app.extensions:
+            app.extensions['cornac.credentials'] = cls(
+                Listener.for_app(app), static=app.config['CREDENTIALS'])
+        return app.extensions['cornac.credentials']
+
+    def __init__(self, listener, static=None):
+        self.listener = listener
+        self.static = static or {}
+        self.secrets = None
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def __getitem__(self, access_key):
+        if access_key in self.static:
+            return self.static[access_key]
+
+        self.listener.subscribe(self.channel, self.invalidate)
+        if not self.listener.is_listening(self.channel):
+            return self.query(access_key)
+
+        secrets = self.secrets
+        if secrets is None:
+            secrets = self.load()
+        return secrets[access_key]
+
+    def invalidate(self, payload=None):
+        with self.lock:
+            self.generation += 1
+            self.secrets = None
+
+    def load(self):
+        generation = self.generation
+        secrets = dict(db.session.query(
+            Credential.access_key, Credential.secret_key))
+        with self.lock:
+            # Don't keep credentials loaded across a change.
+            if generation == self.generation:
+                self.secrets = secrets
+        return secrets
+
+    def query(self, access_key):
+        credential = Credential.query.get(access_key)
+        if credential is None:
+            raise KeyError(access_key)
+        return credential.secret_key
+
+
+def get_credentials():
+    return CredentialStore.for_app(current_app._get_current_object())
@@ -39,6 +39,10 @@ class InvalidParameterCombination(RDSError):
     code = 400
 
 
+class InvalidParameterValue(RDSError):
+    code = 400
+
+
 class IncompleteSignature(RDSError):
     code = 400
 
@@ -62,3 +66,8 @@ class MissingAuthenticationToken(RDSError):
 
 class SignatureDoesNotMatch(RDSError):
     code = 403
+
+
+class Throttling(RDSError):
+    code = 400
+    description = 'Rate exceeded'
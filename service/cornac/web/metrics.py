@@ -0,0 +1,206 @@
+#
+# Prometheus metrics of the RDS API.
+#
+# Each process accumulates metrics in its own slot of an anonymous shared
+# memory mapping, allocated before pre-forking workers. A slot has a single
+# writer, so updates are plain stores without locks. /metrics sums all slots,
+# whichever worker serves it.
+#
+# Metric keys are known at startup: RDS actions, RDS error codes, phases and
+# histogram buckets. This gives a fixed layout of float64 values.
+#
+
+import inspect
+import mmap
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import Blueprint, current_app, make_response
+
+from . import actions, errors
+from ..core.model import db
+
+
+blueprint = Blueprint('metrics', __name__)
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10., float('inf'))
+PHASES = ('auth', 'action', 'render')
+POOL_STATES = ('checkedin', 'checkedout', 'overflow')
+# Action name for unknown actions.
+UNKNOWN = '-'
+
+
+def list_actions():
+    return sorted(
+        name for name, fn in inspect.getmembers(actions, inspect.isfunction)
+        if name[0].isupper() and fn.__module__ == actions.__name__)
+
+
+def list_rdscodes():
+    codes = set()
+    classes = [errors.RDSError]
+    while classes:
+        cls = classes.pop()
+        codes.add(cls.rdscode)
+        classes.extend(cls.__subclasses__())
+    return sorted(codes)
+
+
+class Registry(object):
+    @classmethod
+    def for_app(cls, app, slots=1):
+        if 'cornac.metrics' not in app.extensions:
+            app.extensions['cornac.metrics'] = cls(
+                list_actions() + [UNKNOWN], list_rdscodes(), slots=slots)
+        return app.extensions['cornac.metrics']
+
+    def __init__(self, actions, rdscodes, slots=1):
+        self.actions = actions
+        self.rdscodes = rdscodes
+        keys = [('requests', a) for a in actions]
+        for action in actions:
+            for phase in PHASES:
+                keys.append(('duration_sum', action, phase))
+                keys.extend(
+                    ('duration_bucket', action, phase, le) for le in BUCKETS)
+        keys.extend(('errors', code) for code in rdscodes)
+        keys.extend(('pool', state) for state in POOL_STATES)
+        self.index = {k: i for i, k in enumerate(keys)}
+        self.size = len(keys)
+        self.slots = slots
+        self.offset = 0
+        # Anonymous mapping is shared with forked children.
+        self.mem = mmap.mmap(-1, 8 * self.size * slots)
+        self.values = memoryview(self.mem).cast('d')
+
+    def use_slot(self, slot):
+        # Called in child after fork. Gauges of previous slot owner are
+        # irrelevant.
+        self.offset = slot * self.size
+        for state in POOL_STATES:
+            self.set(('pool', state), 0)
+
+    def inc(self, key, amount=1):
+        self.values[self.offset + self.index[key]] += amount
+
+    def set(self, key, value):
+        self.values[self.offset + self.index[key]] = value
+
+    def count_request(self, action):
+        if action not in self.actions:
+            action = UNKNOWN
+        self.inc(('requests', action))
+
+    def count_error(self, rdscode):
+        key = ('errors', rdscode)
+        if key in self.index:
+            self.inc(key)
+
+    def observe(self, action, phase, seconds):
+        if action not in self.actions:
+            action = UNKNOWN
+        self.inc(('duration_sum', action, phase), seconds)
+        for le in BUCKETS:
+            if seconds <= le:
+                self.inc(('duration_bucket', action, phase, le))
+                break
+
+    @contextmanager
+    def timer(self, action, phase):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(action, phase, perf_counter() - start)
+
+    def timed_iter(self, iterable, action, phase):
+        # Measure time spent generating items of a streamed iterable.
+        elapsed = 0
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += perf_counter() - start
+                yield item
+        finally:
+            self.observe(action, phase, elapsed)
+
+    def update_pool(self, pool):
+        self.set(('pool', 'checkedin'), pool.checkedin())
+        self.set(('pool', 'checkedout'), pool.checkedout())
+        self.set(('pool', 'overflow'), max(0, pool.overflow()))
+
+    def collect(self):
+        totals = [0.] * self.size
+        for slot in range(self.slots):
+            offset = slot * self.size
+            for i in range(self.size):
+                totals[i] += self.values[offset + i]
+        return {k: totals[i] for k, i in self.index.items()}
+
+    def render(self):
+        values = self.collect()
+        lines = [
+            '# HELP cornac_rds_requests_total RDS requests by action.',
+            '# TYPE cornac_rds_requests_total counter',
+        ]
+        for action in self.actions:
+            lines.append(
+                f'cornac_rds_requests_total{{action="{action}"}} '
+                f'{values["requests", action]!r}')
+
+        name = 'cornac_rds_request_duration_seconds'
+        lines.extend([
+            f'# HELP {name} RDS request duration by action and phase.',
+            f'# TYPE {name} histogram',
+        ])
+        for action in self.actions:
+            for phase in PHASES:
+                labels = f'action="{action}",phase="{phase}"'
+                count = 0
+                for le in BUCKETS:
+                    count += values['duration_bucket', action, phase, le]
+                    le = '+Inf' if le == float('inf') else repr(le)
+                    lines.append(
+                        f'{name}_bucket{{{labels},le="{le}"}} {count!r}')
+                lines.append(f'{name}_count{{{labels}}} {count!r}')
+                lines.append(
+                    f'{name}_sum{{{labels}}} '
+                    f'{values["duration_sum", action, phase]!r}')
+
+        lines.extend([
+            '# HELP cornac_rds_errors_total RDS errors by code.',
+            '# TYPE cornac_rds_errors_total counter',
+        ])
+        for code in self.rdscodes:
+            lines.append(
+                f'cornac_rds_errors_total{{rdscode="{code}"}} '
+                f'{values["errors", code]!r}')
+
+        lines.extend([
+            '# HELP cornac_db_pool_connections SQLAlchemy pool connections.',
+            '# TYPE cornac_db_pool_connections gauge',
+        ])
+        for state in POOL_STATES:
+            lines.append(
+                f'cornac_db_pool_connections{{state="{state}"}} '
+                f'{values["pool", state]!r}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def get_registry():
+    return Registry.for_app(current_app._get_current_object())
+
+
+@blueprint.route('/metrics')
+def main():
+    registry = get_registry()
+    registry.update_pool(db.engine.pool)
+    response = make_response(registry.render())
+    response.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
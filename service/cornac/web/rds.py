@@ -11,6 +11,9 @@ from . import (
     xml,
 )
 from .auth import authenticate
+from .metrics import get_registry
+from .throttle import throttle
+from ..core.model import db
 
 
 blueprint = Blueprint('rds', __name__)
@@ -28,42 +31,65 @@ def log(requestid, action_name, identifier, result, code=200,
 @blueprint.route("/rds", methods=["POST"])
 def main():
     # Bridge RDS service and Flask routing. RDS actions are not RESTful.
+
+    # Cache raw body before parsing form, signature is computed on it.
+    request.get_data()
     payload = dict(request.form.items(multi=False))
     action_name = payload.pop('Action')
     version = payload.pop('Version')
     identifier = payload.get('DBInstanceIdentifier', '-')
     requestid = uuid4()
     log_ = partial(log, requestid, action_name, identifier)
+    metrics = get_registry()
 
     try:
         if version != '2014-10-31':
             raise errors.InvalidAction(
                 description=f"Unsupported API version {version}.")
-        g.access_key = authenticate(request)
+        with metrics.timer(action_name, 'auth'):
+            g.access_key = authenticate(request)
         log_ = partial(log_, access_key=g.access_key)
+        throttle(g.access_key, action_name)
         action = getattr(actions, action_name, None)
         if action is None:
             logger.warning("Unknown RDS action: %s.", action_name)
             logger.debug("payload=%r", payload)
             raise errors.InvalidAction()
 
-        response = xml.make_response_xml(
-            action=action_name,
-            result=action(**payload),
-            requestid=requestid,
-        )
+        with metrics.timer(action_name, 'action'):
+            result = action(**payload)
+
+        if isinstance(result, str):
+            with metrics.timer(action_name, 'render'):
+                response = xml.make_response_xml(
+                    action=action_name,
+                    result=result,
+                    requestid=requestid,
+                )
+        else:
+            # Rendering happens while streaming.
+            response = xml.make_response_xml(
+                action=action_name,
+                result=metrics.timed_iter(result, action_name, 'render'),
+                requestid=requestid,
+            )
         log_(result='OK')
     except HTTPException as e:
         if not isinstance(e, errors.RDSError):
             e = errors.RDSError(code=e.code, description=str(e))
         # Still log user error at INFO level.
         log_(code=e.code, result=e.rdscode)
+        metrics.count_error(e.rdscode)
         response = xml.make_error_xml(error=e, requestid=requestid)
     except Exception:
         # Don't expose error.
         e = errors.RDSError()
         current_app.logger.exception("Unhandled RDS error:")
         log_(code=e.code, result=e.rdscode, level=logging.ERROR)
+        metrics.count_error(e.rdscode)
         response = xml.make_error_xml(error=e, requestid=requestid)
+    finally:
+        metrics.count_request(action_name)
+        metrics.update_pool(db.engine.pool)
 
     return response
@@ -0,0 +1,32 @@
+#
+# Receive phone home of new guests.
+#
+# See cornac.ready for the whole picture.
+#
+
+import logging
+
+from flask import Blueprint, current_app, make_response
+
+from ..core.model import db
+from ..ready import CHANNEL, check_token
+
+
+blueprint = Blueprint('ready', __name__)
+logger = logging.getLogger(__name__)
+
+
+@blueprint.route('/ready/<token>', methods=['POST'])
+def main(token):
+    secret = current_app.config['PHONE_HOME_SECRET']
+    name = check_token(secret, token) if secret else None
+    if name is None:
+        logger.warning("Invalid phone home token.")
+        return make_response('Not Found', 404)
+
+    logger.info("%s is ready.", name)
+    db.session.execute(
+        "SELECT pg_notify(:channel, :name);",
+        dict(channel=CHANNEL, name=name))
+    db.session.commit()
+    return make_response('', 204)
@@ -0,0 +1,77 @@
+#
+# Per access key rate limiting of RDS API.
+#
+# Each access key has one token bucket per action class: describe or mutating.
+# Buckets are kept in process memory. With pre-forked workers, each worker has
+# its own buckets, so the effective rate is multiplied by the number of
+# workers.
+#
+
+import threading
+from time import monotonic
+
+from flask import current_app
+
+from . import errors
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst, clock=monotonic):
+        # rate is tokens per second, burst is bucket capacity.
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def consume(self, tokens=1):
+        now = self.clock()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < tokens:
+            return False
+        self.tokens -= tokens
+        return True
+
+
+def action_class(action_name):
+    return 'describe' if action_name.startswith('Describe') else 'mutating'
+
+
+class Throttler(object):
+    @classmethod
+    def for_app(cls, app):
+        if 'cornac.throttler' not in app.extensions:
+            app.extensions['cornac.throttler'] = cls(app.config['RATE_LIMITS'])
+        return app.extensions['cornac.throttler']
+
+    def __init__(self, limits, clock=monotonic):
+        # limits maps action class to (rate, burst) tuple.
+        self.limits = limits or {}
+        self.clock = clock
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def check(self, access_key, action_name):
+        class_ = action_class(action_name)
+        limit = self.limits.get(class_)
+        if not limit:
+            return
+
+        key = access_key, class_
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                rate, burst = limit
+                bucket = self.buckets[key] = TokenBucket(
+                    rate, burst, clock=self.clock)
+            allowed = bucket.consume()
+
+        if not allowed:
+            raise errors.Throttling()
+
+
+def throttle(access_key, action_name):
+    app = current_app._get_current_object()
+    Throttler.for_app(app).check(access_key, action_name)
@@ -1,6 +1,6 @@
-from textwrap import dedent
+from xml.sax.saxutils import escape
 
-from flask import make_response
+from flask import Response, make_response, stream_with_context
 from jinja2 import Template
 
 
@@ -43,42 +43,62 @@ RESPONSE_TMPL = Template("""\
 """)
 
 
-def make_response_xml(action, requestid, result):
-    # Wraps result XML snippet in response XML envelope.
+# Envelope for streamed responses. Result fragments are yielded as is,
+# they must be indented with RESULT_INDENT.
+RESPONSE_HEAD = """\
+<{action}Response xmlns="http://rds.amazonaws.com/doc/2014-10-31/">
+  <{action}Result>
+"""
+RESPONSE_TAIL = """\
+  </{action}Result>
+  <ResponseMetadata>
+    <RequestId>{requestid}</RequestId>
+  </ResponseMetadata>
+</{action}Response>
+"""
+RESULT_INDENT = '    '
 
-    xml = RESPONSE_TMPL.render(**locals())
-    response = make_response(xml)
+
+def make_response_xml(action, requestid, result):
+    # Wraps result XML snippet in response XML envelope. result is either a
+    # string or an iterable of XML fragments to stream.
+
+    if isinstance(result, str):
+        xml = RESPONSE_TMPL.render(**locals())
+        response = make_response(xml)
+    else:
+        response = Response(stream_with_context(
+            iter_response_xml(action, requestid, result)))
     response.content_type = 'text/xml; charset=utf-8'
     response.headers['X-Amzn-RequestId'] = requestid
     return response
 
 
+def iter_response_xml(action, requestid, fragments):
+    yield RESPONSE_HEAD.format(action=action)
+    yield from fragments
+    yield RESPONSE_TAIL.format(action=action, requestid=requestid)
+
+
+def iter_list_xml(tag, encoders, marker=None, indent=RESULT_INDENT):
+    # Yields list XML fragments, one per item, for streaming.
+    yield f'{indent}<{tag}>\n'
+    for encoder in encoders:
+        yield encoder.as_xml(indent=indent + '  ') + '\n'
+    yield f'{indent}</{tag}>\n'
+    if marker:
+        yield f'{indent}<Marker>{marker}</Marker>\n'
+
+
 def booltostr(value):
     return 'true' if value is True else 'false'
 
 
 class InstanceEncoder:
     # Adapt DBInstance object to RDS XML response.
-
-    XML_SNIPPET_TMPL = Template(dedent("""\
-    <DBInstance>
-      <DBInstanceIdentifier>{{ identifier }}</DBInstanceIdentifier>
-      <Engine>postgres</Engine>
-      <DBInstanceStatus>{{ status }}</DBInstanceStatus>
-    {% if endpoint_address %}
-      <Endpoint>
-        <Address>{{ endpoint_address }}</Address>
-        <Port>5432</Port>
-      </Endpoint>
-    {% endif %}
-    {% for field in known_fields %}
-      <{{ field }}>{{ data[field] }}</{{ field }}>
-    {% endfor %}
-    </DBInstance>
-    """), trim_blocks=True)
-
-    def __init__(self, instance):
-        self.instance = instance
+    #
+    # XML is formatted with plain string formatting rather than a template,
+    # Describe* actions encode a lot of instances.
 
     _known_fields = [
         'MasterUsername',
@@ -87,24 +107,39 @@ class InstanceEncoder:
         'MultiAZ',
     ]
 
-    def as_xml(self):
+    def __init__(self, instance):
+        self.instance = instance
+
+    def as_xml(self, indent=''):
         data = self.instance.data or {}
+        lines = [
+            '<DBInstance>',
+            '  <DBInstanceIdentifier>%s</DBInstanceIdentifier>' % (
+                escape(self.instance.identifier),),
+            '  <Engine>postgres</Engine>',
+            '  <DBInstanceStatus>%s</DBInstanceStatus>' % (
+                self.instance.status,),
+        ]
+
         try:
             endpoint_address = data['Endpoint']['Address']
         except KeyError:
-            endpoint_address = None
-
-        data = {
-            k: booltostr(v) if v in (True, False) else v
-            for k, v in data.items()
-        }
-        known_fields = [
-            h for h in self._known_fields
-            if h in data]
-
-        kw = dict(self.instance.__dict__, data=data)
-        return self.XML_SNIPPET_TMPL.render(
-            endpoint_address=endpoint_address,
-            known_fields=known_fields,
-            **kw,
-        )
+            pass
+        else:
+            lines.extend([
+                '  <Endpoint>',
+                '    <Address>%s</Address>' % (escape(endpoint_address),),
+                '    <Port>5432</Port>',
+                '  </Endpoint>',
+            ])
+
+        for field in self._known_fields:
+            if field not in data:
+                continue
+            value = data[field]
+            if value in (True, False):
+                value = booltostr(value)
+            lines.append('  <%s>%s</%s>' % (field, escape(str(value)), field))
+
+        lines.append('</DBInstance>')
+        return '\n'.join(indent + line for line in lines)
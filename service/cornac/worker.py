@@ -1,20 +1,34 @@
 import functools
 import logging
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
+from datetime import timedelta
+from time import monotonic
 
 from flask import current_app
 from flask_dramatiq import Dramatiq
 
 from .core.config import require_ssh_key
-from .core.model import DBInstance, db
+from .core.model import DBInstance, DBInstanceStatus, WarmMachine, db
 from .errors import KnownError
-from .iaas import IaaS
+from .iaas.pool import IaaSPool
 from .operator import BasicOperator
+from .ready import ReadyWaiter
 from .ssh import wait_machine
 
 
 dramatiq = Dramatiq()
 logger = logging.getLogger(__name__)
+# Statuses that inspection may overwrite. Other statuses belong to a running
+# task.
+INSPECTABLE_STATUSES = ('available', 'failed', 'stopped')
+# Milliseconds before retrying a provisioning stage at its concurrency limit.
+STAGE_RETRY_DELAY = 5000
+# Per process semaphores limiting concurrency of provisioning stages.
+stage_semaphores = {}
+stage_semaphores_lock = threading.Lock()
 
 
 class TaskStop(Exception):
@@ -23,10 +37,12 @@ class TaskStop(Exception):
     pass
 
 
-def actor(fn):
-    # Declare and wraps a background task function.
+def actor(fn=None, **options):
+    # Declare and wraps a background task function. options are passed to
+    # dramatiq, e.g. queue_name. Use either @actor or @actor(**options).
+    if fn is None:
+        return functools.partial(actor, **options)
 
-    @dramatiq.actor
     @functools.wraps(fn)
     def actor_wrapper(*a, **kw):
         try:
@@ -41,7 +57,14 @@ def actor(fn):
         # Swallow errors so that Dramatiq don't retry task. We want Dramatiq to
         # retry task only on SIGKILL.
 
-    return actor_wrapper
+    if options:
+        return dramatiq.actor(actor_wrapper, **options)
+    return dramatiq.actor(actor_wrapper)
+
+
+def borrow_iaas():
+    # Borrow an IaaS session from the pool of current worker process.
+    return IaaSPool.for_app(current_app).borrow()
 
 
 def get_instance(instance):
@@ -81,16 +104,61 @@ def state_manager(instance, from_=None, to_='available'):
         db.session.commit()
 
 
-@actor
+# Creation of an instance is a pipeline of stages. Each stage has its own
+# queue and concurrency limit, so that a burst of creations overlaps stages of
+# distinct instances while each stage is throttled on its own bottleneck.
+#
+# - provision clones and boots the machine, or claims a warm machine.
+# - prepare formats data disk and runs initdb.
+# - configure creates master user and database.
+
+
+@actor(queue_name='provision')
 def create_db(instance_id):
     require_ssh_key()
-    config = current_app.config
-    with state_manager(instance_id, from_='creating') as instance:
-        with IaaS.connect(config['IAAS'], config) as iaas:
-            operator = BasicOperator(iaas, current_app.config)
-            response = operator.create_db_instance(instance.data)
+    with provisioning_stage(create_db, instance_id, 'provision') as (
+            instance, operator):
+        command = instance.data
+        warm = claim_warm_machine(command)
+        if warm:
+            try:
+                operator.claim_machine(warm.name, instance.identifier)
+            finally:
+                # Claimed machine is either renamed or deleted. Drop it from
+                # the warm pool only now, so that it is never leaked.
+                db.session.delete(warm)
+                db.session.commit()
+                if current_app.config['WARM_POOL']:
+                    refill_warm_pool.send()
+            # Warm machine has already a Postgres instance.
+            next_stage = create_db_configure
+        else:
+            if current_app.config['WARM_POOL']:
+                refill_warm_pool.send()
+            operator.provision_machine(
+                instance.identifier, command['AllocatedStorage'])
+            next_stage = create_db_prepare
+    next_stage.send(instance_id)
 
-        instance.status = 'available'
+
+@actor(queue_name='prepare')
+def create_db_prepare(instance_id):
+    require_ssh_key()
+    with provisioning_stage(create_db_prepare, instance_id, 'prepare') as (
+            instance, operator):
+        operator.prepare_instance(
+            instance.identifier, instance.data['EngineVersion'])
+    create_db_configure.send(instance_id)
+
+
+@actor(queue_name='configure')
+def create_db_configure(instance_id):
+    require_ssh_key()
+    with provisioning_stage(
+            create_db_configure, instance_id, 'configure',
+            to_='available') as (instance, operator):
+        response = operator.configure_instance(
+            instance.identifier, instance.data)
         instance.data = dict(
             instance.data,
             # Drop password from data.
@@ -99,45 +167,313 @@ def create_db(instance_id):
         )
 
 
+@contextmanager
+def provisioning_stage(actor_, instance_id, stage, to_='creating'):
+    # Run a provisioning stage of a creating instance with an operator. If the
+    # stage is at its concurrency limit in this process, queue the message
+    # again with a delay instead of blocking a worker thread. Records stage
+    # duration in operator_data.
+    semaphore = get_stage_semaphore(stage)
+    if not semaphore.acquire(blocking=False):
+        actor_.send_with_options(args=(instance_id,), delay=STAGE_RETRY_DELAY)
+        raise TaskStop(f"Stage {stage} is full, delaying {instance_id}.")
+
+    try:
+        with state_manager(instance_id, from_='creating', to_=to_) as instance:
+            logger.info("Running stage %s of %s.", stage, instance)
+            start = monotonic()
+            with borrow_iaas() as iaas:
+                yield instance, BasicOperator(
+                    iaas, current_app.config,
+                    ready=ReadyWaiter.for_app(current_app))
+            operator_data = instance.operator_data or {}
+            durations = dict(
+                operator_data.get('durations', {}),
+                **{stage: round(monotonic() - start, 3)})
+            instance.operator_data = dict(operator_data, durations=durations)
+            logger.info(
+                "Stage %s of %s done in %.1fs.",
+                stage, instance, durations[stage])
+    finally:
+        semaphore.release()
+
+
+def get_stage_semaphore(stage):
+    with stage_semaphores_lock:
+        if stage not in stage_semaphores:
+            limit = current_app.config['PROVISIONING_CONCURRENCY'][stage]
+            stage_semaphores[stage] = threading.BoundedSemaphore(limit)
+        return stage_semaphores[stage]
+
+
+def claim_warm_machine(command):
+    # Returns a ready warm machine matching command, or None. The claimed
+    # machine is marked not ready so that concurrent claims skip it. Caller
+    # must remove it from the warm pool once claimed.
+    warm = (
+        WarmMachine.query
+        .filter(WarmMachine.ready.is_(True))
+        .filter(WarmMachine.storage_pool == current_app.config['STORAGE_POOL'])
+        .filter(WarmMachine.engine_version == command['EngineVersion'])
+        .filter(WarmMachine.allocated_storage == command['AllocatedStorage'])
+        .order_by(WarmMachine.id)
+        # Concurrent claims take distinct machines.
+        .with_for_update(skip_locked=True)
+        .first()
+    )
+    if warm is None:
+        return None
+    logger.info("Claiming %s.", warm)
+    warm.ready = False
+    warm.mtime = db.func.now()
+    db.session.commit()
+    return warm
+
+
 @actor
-def delete_db_instance(instance_id):
+def refill_warm_pool():
     config = current_app.config
+    storage_pool = config['STORAGE_POOL']
+    # Serialize refills, to not provision too many machines. Claims wait for
+    # refill transaction too.
+    db.session.execute(
+        "LOCK TABLE warm_machines IN SHARE ROW EXCLUSIVE MODE;")
+    # Reap machines abandoned while provisioning or claiming, they would
+    # never be ready nor removed.
+    stale = query_stale_warm_machines(
+        storage_pool, config['WARM_MACHINE_TIMEOUT']).all()
+    for warm in stale:
+        logger.warning("Reaping stale %s.", warm)
+        db.session.delete(warm)
+    db.session.flush()
+    stale = [warm.name for warm in stale]
+    counts = {
+        (pgversion, size_gb): count
+        for pgversion, size_gb, count in (
+            db.session.query(
+                WarmMachine.engine_version, WarmMachine.allocated_storage,
+                db.func.count())
+            .filter(WarmMachine.storage_pool == storage_pool)
+            .group_by(
+                WarmMachine.engine_version, WarmMachine.allocated_storage)
+        )
+    }
+    warms = []
+    for (pgversion, size_gb), wanted in config['WARM_POOL'].items():
+        for _ in range(wanted - counts.get((pgversion, size_gb), 0)):
+            warm = WarmMachine()
+            # Double hyphen prevents clash with instance identifiers.
+            warm.name = '-warm-' + secrets.token_hex(4)
+            warm.storage_pool = storage_pool
+            warm.engine_version = pgversion
+            warm.allocated_storage = size_gb
+            db.session.add(warm)
+            warms.append(warm)
+    db.session.commit()
+
+    if stale:
+        with borrow_iaas() as iaas:
+            for name in stale:
+                # Machine may be gone, e.g. renamed by claim before worker
+                # died.
+                try:
+                    iaas.delete_machine(name)
+                except Exception as e:
+                    logger.warning("Failed to delete %s: %s.", name, e)
+
+    for warm in warms:
+        logger.info("Queuing provisioning of %s.", warm)
+        create_warm_machine.send(warm.id)
+
+
+def query_stale_warm_machines(storage_pool, timeout):
+    # Query warm machines not ready for more than timeout seconds.
+    return (
+        WarmMachine.query
+        .filter(WarmMachine.storage_pool == storage_pool)
+        .filter(WarmMachine.ready.is_(False))
+        .filter(WarmMachine.mtime < db.func.now() - timedelta(seconds=timeout))
+    )
+
+
+@actor
+def create_warm_machine(warm_id):
+    require_ssh_key()
+    warm = WarmMachine.query.get(warm_id)
+    if warm is None:
+        raise TaskStop(f"Unknown warm machine {warm_id}.")
+    # Message may have waited in queue, don't reap it while provisioning.
+    warm.mtime = db.func.now()
+    db.session.commit()
+
+    try:
+        with borrow_iaas() as iaas:
+            operator = BasicOperator(
+                iaas, current_app.config,
+                ready=ReadyWaiter.for_app(current_app))
+            operator.create_warm_machine(
+                warm.name, warm.storage_pool, warm.engine_version,
+                warm.allocated_storage)
+    except Exception:
+        # Let next refill retry.
+        db.session.delete(warm)
+        db.session.commit()
+        with borrow_iaas() as iaas:
+            iaas.delete_machine(warm.name)
+        raise
+
+    warm.ready = True
+    db.session.commit()
+    logger.info("%s ready.", warm)
+
+
+@actor
+def delete_db_instance(instance_id):
     with state_manager(instance_id, from_='deleting') as instance:
         logger.info("Deleting %s.", instance)
-        with IaaS.connect(config['IAAS'], config) as iaas:
+        with borrow_iaas() as iaas:
             iaas.delete_machine(instance.identifier)
         db.session.delete(instance)
 
 
+@actor
+def exec_instances(filters, command, concurrency=None):
+    # Run pghelper.sh command on instances matching filters, logging results
+    # as they complete.
+    # Import lazily, fleet imports web actions which import worker.
+    from .fleet import iter_exec, select_targets
+
+    require_ssh_key()
+    targets = select_targets(filters)
+    # Don't keep transaction open while running commands.
+    db.session.commit()
+    concurrency = concurrency or current_app.config['EXEC_CONCURRENCY']
+    logger.info(
+        "Running %s on %s instances.", ' '.join(command), len(targets))
+    failures = 0
+    for result in iter_exec(targets, command, concurrency):
+        if result.error:
+            failures += 1
+            logger.error(
+                "%s failed in %.3fs: %s.",
+                result.identifier, result.duration, result.error)
+        else:
+            logger.info(
+                "%s done in %.3fs:\n%s",
+                result.identifier, result.duration, result.output.rstrip())
+    logger.info(
+        "%s ran on %s instances, %s failed.",
+        ' '.join(command), len(targets), failures)
+
+
 @actor
 def inspect_instance(instance_id):
     require_ssh_key()
     instance = get_instance(instance_id)
     config = current_app.config
-    with IaaS.connect(config['IAAS'], config) as iaas:
-        if iaas.is_running(instance.identifier):
+    with borrow_iaas() as iaas:
+        running = iaas.is_running(instance.identifier)
+        if running:
             operator = BasicOperator(iaas, config)
-            if operator.is_running(instance.identifier):
-                instance.status = 'available'
-                instance.status_message = None
-            else:
-                instance.status = 'failed'
-                instance.status_message = \
-                    'VM is running but Postgres is not running.'
+            postgres = operator.is_running(instance.identifier)
         else:
-            instance.status = 'stopped'
-            instance.status_message = None
+            postgres = False
 
+    instance.status, instance.status_message = inspected_status(
+        running, postgres)
     db.session.commit()
     logger.info("%s inspected.", instance)
 
 
 @actor
-def reboot_db_instance(instance_id):
+def inspect_instances(instance_ids=None):
+    # Inspect many instances with a single IaaS request and concurrent
+    # Postgres probes. Inspects all instances if instance_ids is None.
+    require_ssh_key()
     config = current_app.config
+    qry = (
+        db.session.query(
+            DBInstance.id, DBInstance.identifier, DBInstance.status,
+            DBInstance.status_message, DBInstance.data)
+        .filter(DBInstance.status.in_(INSPECTABLE_STATUSES))
+    )
+    if instance_ids is not None:
+        qry = qry.filter(DBInstance.id.in_(instance_ids))
+    instances = qry.all()
+    # Don't keep transaction open while probing guests.
+    db.session.commit()
+    if not instances:
+        return logger.info("No instances to inspect.")
+
+    with borrow_iaas() as iaas:
+        logger.info("Inspecting %s instances.", len(instances))
+        states = iaas.power_states()
+        operator = BasicOperator(iaas, config)
+        probed = [i for i in instances if states.get(i.identifier)]
+        addresses = []
+        for instance in probed:
+            endpoint = (instance.data or {}).get('Endpoint') or {}
+            addresses.append(
+                endpoint.get('Address') or iaas.endpoint(instance.identifier))
+
+        with ThreadPoolExecutor(config['INSPECT_CONCURRENCY']) as executor:
+            postgres = dict(zip(
+                (i.id for i in probed),
+                executor.map(operator.probe, addresses),
+            ))
+
+    changes = {}
+    for instance in instances:
+        if instance.identifier in states:
+            status = inspected_status(
+                states[instance.identifier], postgres.get(instance.id))
+        else:
+            status = 'failed', 'VM not found in IaaS.'
+        if status != (instance.status, instance.status_message):
+            changes[instance.id] = status
+
+    if changes:
+        db.session.execute(build_status_update(changes))
+        db.session.commit()
+    logger.info(
+        "%s instances inspected, %s changed.", len(instances), len(changes))
+
+
+def inspected_status(running, postgres):
+    # Returns status and status message of an instance from VM and Postgres
+    # states.
+    if not running:
+        return 'stopped', None
+    elif postgres:
+        return 'available', None
+    else:
+        return 'failed', 'VM is running but Postgres is not running.'
+
+
+def build_status_update(changes):
+    # Build a single UPDATE statement for status changes of many instances.
+    # changes maps instance id to status and status message.
+    table = DBInstance.__table__
+    statuses = {id_: status for id_, (status, _) in changes.items()}
+    messages = {id_: message for id_, (_, message) in changes.items()}
+    return (
+        table.update()
+        .where(table.c.id.in_(list(changes)))
+        # Don't overwrite status set by a concurrent task.
+        .where(table.c.status.in_(INSPECTABLE_STATUSES))
+        .values(
+            status=db.cast(
+                db.case(statuses, value=table.c.id), DBInstanceStatus),
+            status_message=db.case(messages, value=table.c.id),
+        )
+    )
+
+
+@actor
+def reboot_db_instance(instance_id):
     with state_manager(instance_id) as instance:
         logger.info("Rebooting %s.", instance)
-        with IaaS.connect(config['IAAS'], config) as iaas:
+        with borrow_iaas() as iaas:
             iaas.stop_machine(instance.identifier)
             iaas.start_machine(instance.identifier)
         wait_machine(instance.data['Endpoint']['Address'])
@@ -159,18 +495,16 @@ def recover_instances():
 
 @actor
 def start_db_instance(instance_id):
-    config = current_app.config
     with state_manager(instance_id) as instance:
         logger.info("Starting %s.", instance)
-        with IaaS.connect(config['IAAS'], config) as iaas:
+        with borrow_iaas() as iaas:
             iaas.start_machine(instance.identifier)
         wait_machine(instance.data['Endpoint']['Address'])
 
 
 @actor
 def stop_db_instance(instance_id):
-    config = current_app.config
     with state_manager(instance_id) as instance:
         logger.info("Stopping %s.", instance)
-        with IaaS.connect(config['IAAS'], config) as iaas:
+        with borrow_iaas() as iaas:
             iaas.stop_machine(instance.identifier)
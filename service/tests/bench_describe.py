@@ -0,0 +1,112 @@
+#
+# Benchmark DescribeDBInstances XML rendering.
+#
+# Compares legacy rendering, one template per instance re-indented in list and
+# response templates, with streamed rendering. Run with:
+#
+#     poetry run python tests/bench_describe.py [COUNT]
+#
+
+import sys
+import tracemalloc
+from textwrap import dedent
+from time import perf_counter
+from types import SimpleNamespace
+
+from jinja2 import Template
+
+from cornac.web import xml
+
+
+LEGACY_INSTANCE_TMPL = Template(dedent("""\
+<DBInstance>
+  <DBInstanceIdentifier>{{ identifier }}</DBInstanceIdentifier>
+  <Engine>postgres</Engine>
+  <DBInstanceStatus>{{ status }}</DBInstanceStatus>
+{% if endpoint_address %}
+  <Endpoint>
+    <Address>{{ endpoint_address }}</Address>
+    <Port>5432</Port>
+  </Endpoint>
+{% endif %}
+{% for field in known_fields %}
+  <{{ field }}>{{ data[field] }}</{{ field }}>
+{% endfor %}
+</DBInstance>
+"""), trim_blocks=True)
+
+
+LEGACY_LIST_TMPL = Template(dedent("""\
+<DBInstances>
+{% for instance in instances %}
+  {{ instance | indent(2) }}
+{% endfor %}
+</DBInstances>
+"""), trim_blocks=True)
+
+
+def legacy_render(instances):
+    snippets = []
+    for instance in instances:
+        data = {
+            k: xml.booltostr(v) if v in (True, False) else v
+            for k, v in instance.data.items()
+        }
+        snippets.append(LEGACY_INSTANCE_TMPL.render(
+            endpoint_address=data['Endpoint']['Address'],
+            known_fields=[
+                f for f in xml.InstanceEncoder._known_fields if f in data],
+            **dict(instance.__dict__, data=data)))
+    result = LEGACY_LIST_TMPL.render(instances=snippets)
+    body = xml.RESPONSE_TMPL.render(
+        action='DescribeDBInstances', requestid='bench', result=result)
+    return len(body.encode('utf-8'))
+
+
+def streamed_render(instances):
+    fragments = xml.iter_response_xml(
+        'DescribeDBInstances', 'bench',
+        xml.iter_list_xml(
+            'DBInstances', (xml.InstanceEncoder(i) for i in instances)))
+    # Mimic WSGI server writing each chunk to the socket.
+    return sum(len(f.encode('utf-8')) for f in fragments)
+
+
+def make_instances(count):
+    return [
+        SimpleNamespace(
+            identifier=f'db{i}',
+            status='available',
+            data=dict(
+                AllocatedStorage=5,
+                Endpoint=dict(Address=f'cornac-db{i}.virt', Port=5432),
+                InstanceCreateTime='2019-05-01T00:00:00Z',
+                MasterUsername='postgres',
+                MultiAZ=False,
+            ),
+        )
+        for i in range(count)
+    ]
+
+
+def bench(name, render, instances):
+    tracemalloc.start()
+    start = perf_counter()
+    size = render(instances)
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>10}: {elapsed * 1000:8.1f} ms, "
+        f"peak {peak / 1024:8.0f} KiB, response {size / 1024:.0f} KiB")
+
+
+def main(count=10000):
+    instances = make_instances(count)
+    print(f"Rendering {count} instances.")
+    bench('legacy', legacy_render, instances)
+    bench('streamed', streamed_render, instances)
+
+
+if '__main__' == __name__:
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,47 @@
+import pytest
+
+
+def test_parse_pagination():
+    from cornac.web.actions import errors, parse_pagination
+
+    assert (100, None) == parse_pagination({})
+    assert (20, 42) == parse_pagination(dict(MaxRecords='20', Marker='42'))
+
+    with pytest.raises(errors.InvalidParameterValue):
+        parse_pagination(dict(MaxRecords='pouet'))
+
+    with pytest.raises(errors.InvalidParameterValue):
+        parse_pagination(dict(MaxRecords='1000'))
+
+    with pytest.raises(errors.InvalidParameterValue):
+        parse_pagination(dict(Marker='pouet'))
+
+
+def test_parse_filters():
+    from cornac.web.actions import errors, parse_filters
+
+    assert [] == parse_filters(dict(DBInstanceIdentifier='pouet'))
+
+    command = {
+        'Filters.Filter.2.Name': 'engine',
+        'Filters.Filter.2.Values.Value.1': 'postgres',
+        'Filters.Filter.1.Name': 'db-instance-id',
+        'Filters.Filter.1.Values.Value.2': 'db1',
+        'Filters.Filter.1.Values.Value.1': 'db0',
+    }
+    assert [
+        ('db-instance-id', ['db0', 'db1']),
+        ('engine', ['postgres']),
+    ] == parse_filters(command)
+
+    with pytest.raises(errors.InvalidParameterValue):
+        parse_filters({
+            'Filters.Filter.1.Name': 'unknown',
+            'Filters.Filter.1.Values.Value.1': 'value',
+        })
+
+    with pytest.raises(errors.InvalidParameterValue):
+        parse_filters({'Filters.Filter.1.Name': 'engine'})
+
+    with pytest.raises(errors.InvalidParameterValue):
+        parse_filters({'Filters.Filter.1.Values.Value.1': 'postgres'})
@@ -55,8 +55,7 @@ def test_parse_authorization():
 
 
 def test_check_authorization(app, mocker):
-    SigV4Auth = mocker.patch('cornac.web.auth.SigV4Auth')
-    mk_awsreq = mocker.patch('cornac.web.auth.make_boto_request')
+    compute_signature = mocker.patch('cornac.web.auth.compute_signature')
 
     from cornac.web.auth import Authorization, check_request_signature, errors
 
@@ -65,10 +64,7 @@ def test_check_authorization(app, mocker):
         'Host': 'localhost',
         'X-Amz-Date': '2019…',
     })
-    awsreq = mk_awsreq.return_value
-    awsreq.context = {}
-    signer = SigV4Auth.return_value
-    signer.signature.return_value = 'mocked-signature'
+    compute_signature.return_value = 'mocked-signature'
 
     auth = Authorization(
         access_key='k',
@@ -103,7 +99,12 @@ def test_check_authorization(app, mocker):
 
 
 def test_check_signature(app, mocker):
-    from cornac.web.auth import Authorization, check_request_signature
+    from cornac.web.auth import (
+        Authorization,
+        check_request_signature,
+        derive_signing_key,
+        errors,
+    )
 
     # Reproduce a sniffed awscli request.
     sig = 'ba2313b677a9d953205cf6f1be9d9f4f4e01c0a84350c334d2f1730761375804'
@@ -148,3 +149,60 @@ def test_check_signature(app, mocker):
             ctx.request,
             auth, secret_key='notsecret',
             region='local')
+
+    # Signing key is derived once per day.
+    with app.test_request_context(**kw) as ctx:
+        hits = derive_signing_key.cache_info().hits
+        check_request_signature(
+            ctx.request,
+            auth, secret_key='notsecret',
+            region='local')
+        assert hits + 1 == derive_signing_key.cache_info().hits
+
+    # Form parsing does not break signature.
+    with app.test_request_context(**kw) as ctx:
+        ctx.request.get_data()
+        assert 'DescribeDBInstances' == ctx.request.form['Action']
+        check_request_signature(
+            ctx.request,
+            auth, secret_key='notsecret',
+            region='local')
+
+    with app.test_request_context(**kw) as ctx:
+        with pytest.raises(errors.SignatureDoesNotMatch):
+            check_request_signature(
+                ctx.request,
+                auth, secret_key='othersecret',
+                region='local')
+
+
+def test_credential_store(mocker):
+    db = mocker.patch('cornac.web.credentials.db')
+    Credential = mocker.patch('cornac.web.credentials.Credential')
+    from cornac.web.credentials import CredentialStore
+
+    listener = mocker.Mock(name='listener')
+    store = CredentialStore(listener, static=dict(STATICKEY='static'))
+    assert 'static' == store['STATICKEY']
+
+    # Without notifications, query each lookup.
+    listener.is_listening.return_value = False
+    Credential.query.get.return_value.secret_key = 'queried'
+    assert 'queried' == store['DBKEY']
+    Credential.query.get.return_value = None
+    with pytest.raises(KeyError):
+        store['UNKNOWN']
+
+    # While listening, load table once.
+    listener.is_listening.return_value = True
+    db.session.query.return_value = [('DBKEY', 'loaded')]
+    assert 'loaded' == store['DBKEY']
+    with pytest.raises(KeyError):
+        store['UNKNOWN']
+    assert 1 == db.session.query.call_count
+
+    # Reload on notification.
+    store.invalidate('INSERT')
+    db.session.query.return_value = [('NEWKEY', 'new')]
+    assert 'new' == store['NEWKEY']
+    assert 2 == db.session.query.call_count
@@ -0,0 +1,25 @@
+def test_response_cache():
+    from cornac.web.cache import ResponseCache
+
+    cache = ResponseCache(size=2)
+    assert cache.get('a') is None
+
+    cache.set('a', 'A', cache.generation)
+    assert 'A' == cache.get('a')
+
+    # LRU eviction.
+    cache.set('b', 'B', cache.generation)
+    cache.get('a')
+    cache.set('c', 'C', cache.generation)
+    assert cache.get('b') is None
+    assert 'A' == cache.get('a')
+
+    # Invalidation flushes entries.
+    cache.invalidate('UPDATE')
+    assert cache.get('a') is None
+
+    # Don't store value computed before invalidation.
+    generation = cache.generation
+    cache.invalidate(None)
+    cache.set('a', 'A', generation)
+    assert cache.get('a') is None
@@ -9,3 +9,49 @@ def test_version(capsys, mocker):
     assert 'Python 3.' in out
     assert 'Werkzeug' in out
     assert 'Bjoern' in out
+
+
+def list_imports(code, env=None):
+    import subprocess
+    import sys
+
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        env=env, stderr=subprocess.PIPE, universal_newlines=True)
+    imported = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, _, name = line.rpartition('|')
+        imported.add(name.strip())
+    return imported
+
+
+def test_import_time():
+    # Each command imports its own dependencies. Ensure heavy modules are not
+    # imported by the CLI module itself.
+    imported = list_imports('import cornac.cli')
+    assert 'cornac' in imported
+    for heavy in 'bjoern', 'botocore', 'dramatiq', 'pkg_resources', \
+            'psycopg2', 'sqlalchemy':
+        assert heavy not in imported
+
+
+def test_command_import_time():
+    import os
+
+    env = dict(
+        os.environ,
+        # Refuse connection, commands fail once app is loaded.
+        CORNAC_SQLALCHEMY_DATABASE_URI='postgresql://127.0.0.1:9/cornac',
+    )
+    code = 'from cornac.cli import root; root.main(%r)'
+
+    imported = list_imports(code % (['migratedb'],), env=env)
+    assert 'cornac.core.model' in imported
+    assert 'cornac.web' not in imported
+    assert 'dramatiq' not in imported
+
+    imported = list_imports(code % (['inspect'],), env=env)
+    assert 'cornac.worker' in imported
+    assert 'cornac.web' not in imported
@@ -0,0 +1,51 @@
+import pytest
+
+
+def test_parse_filter():
+    from cornac.errors import KnownError
+    from cornac.fleet import parse_filter
+
+    assert ('engine-version', ['10', '11']) == \
+        parse_filter('engine-version=10,11')
+
+    with pytest.raises(KnownError):
+        parse_filter('unknown=1')
+
+    with pytest.raises(KnownError):
+        parse_filter('engine')
+
+
+def test_iter_exec(mocker):
+    from threading import Event
+    from time import sleep
+
+    shell_cls = mocker.patch('cornac.fleet.RemoteShell')
+    fast, down = Event(), Event()
+
+    def run(address):
+        def run(command):
+            if 'slow' == address:
+                # Wait for other hosts to complete.
+                assert fast.wait(5) and down.wait(5)
+                sleep(.1)
+            elif 'down' == address:
+                down.set()
+                raise Exception("Connection refused")
+            else:
+                fast.set()
+            return f"{command[-1]} on {address}\n"
+        return run
+
+    shell_cls.side_effect = lambda user, address: run(address)
+    from cornac.fleet import iter_exec
+
+    results = list(iter_exec(
+        [('db0', 'slow'), ('db1', 'fast'), ('db2', 'down')],
+        ['psql', '-l'], concurrency=3))
+
+    assert 'db0' == results[-1].identifier
+    assert "-l on slow\n" == results[-1].output
+    failed, = [r for r in results if r.error]
+    assert 'db2' == failed.identifier
+    assert 'refused' in failed.error
+    assert all(r.duration >= 0 for r in results)
@@ -0,0 +1,310 @@
+import pytest
+
+
+def test_pool_reuse(mocker):
+    from cornac.iaas.pool import IaaSPool
+
+    connect = mocker.Mock(side_effect=lambda *a: mocker.Mock())
+    pool = IaaSPool('fake', {}, size=1, keepalive=0, connect=connect)
+
+    with pool.borrow() as iaas0:
+        pass
+    with pool.borrow() as iaas1:
+        assert iaas1 is iaas0
+    assert 1 == connect.call_count
+    # keepalive=0 checks session on each borrow.
+    assert 1 == iaas0.ping.call_count
+
+    # Pool is full, extra session is closed.
+    with pool.borrow() as iaas1:
+        with pool.borrow() as iaas2:
+            pass
+    assert iaas1 is not iaas2
+    assert [iaas2] == [s for _, s in pool.idle]
+    assert iaas1.close.called
+
+
+def test_pool_dead_session(mocker):
+    import os
+    from cornac.iaas.pool import IaaSPool
+
+    connect = mocker.Mock(name='connect')
+    pool = IaaSPool('fake', {}, size=1, keepalive=3600, connect=connect)
+    pool.ensure_process = mocker.Mock(name='ensure_process')
+    pool.pid = os.getpid()
+
+    # Task error with live session: reuse session.
+    with pytest.raises(Exception):
+        with pool.borrow() as iaas:
+            raise Exception('task error')
+    assert 1 == len(pool.idle)
+    assert not iaas.close.called
+
+    # Task error with dead session: close session.
+    iaas.ping.side_effect = Exception('NotAuthenticated')
+    with pytest.raises(Exception):
+        with pool.borrow() as iaas:
+            raise Exception('task error')
+    assert 0 == len(pool.idle)
+    assert iaas.close.called
+
+
+def test_pool_keepalive(mocker):
+    import os
+    from cornac.iaas.pool import IaaSPool
+
+    pool = IaaSPool('fake', {}, size=2, keepalive=3600)
+    pool.pid = os.getpid()
+    alive = mocker.Mock(name='alive')
+    dead = mocker.Mock(name='dead')
+    dead.ping.return_value = False
+    fresh = mocker.Mock(name='fresh')
+    inf = float('inf')
+    pool.idle = [(-inf, alive), (-inf, dead), (inf, fresh)]
+
+    pool.ping_idle()
+
+    assert [alive, fresh] == [s for _, s in pool.idle]
+    assert dead.close.called
+    assert not fresh.ping.called
+
+
+def test_vcenter_inventory(mocker):
+    pytest.importorskip('pyVmomi')
+    from cornac.iaas.vcenter import Inventory
+
+    def mo(moid):
+        return mocker.Mock(name=moid, _moId=moid)
+
+    def prop(name, val):
+        # Mock() name argument is reserved.
+        prop = mocker.Mock(op='assign', val=val)
+        prop.name = name
+        return prop
+
+    def change(obj, kind='enter', **props):
+        return mocker.Mock(obj=obj, kind=kind, changeSet=[
+            prop(k, v) for k, v in props.items()
+        ])
+
+    root, dc, vmfolder, vm = mo('group-d1'), mo('dc'), mo('group-v1'), mo('vm')
+    content = mocker.Mock(name='content', rootFolder=root)
+    inventory = Inventory(content)
+    inventory.apply(mocker.Mock(filterSet=[mocker.Mock(objectSet=[
+        change(root, name='Datacenters', parent=None),
+        change(dc, name='dc1', parent=root),
+        change(vmfolder, name='vm', parent=dc),
+        change(vm, name='cornac-db0', parent=vmfolder),
+    ])]))
+    inventory.polled = float('inf')
+
+    assert vm is inventory.find('dc1/vm/cornac-db0')
+    assert 'cornac-db0' == inventory.get(vm, 'name')
+
+    # Rename VM.
+    inventory.apply(mocker.Mock(filterSet=[mocker.Mock(objectSet=[
+        change(vm, kind='modify', name='cornac-db1'),
+    ])]))
+    assert vm is inventory.find('dc1/vm/cornac-db1')
+    inventory.pc.WaitForUpdatesEx.return_value = None
+    with pytest.raises(KeyError):
+        inventory.find('dc1/vm/cornac-db0')
+
+
+def test_libvirt_wait_state(mocker):
+    libvirt = pytest.importorskip('libvirt')
+    import threading
+    from cornac.iaas.libvirt import LibVirtIaaS, Timeout
+
+    iaas = LibVirtIaaS(mocker.Mock(name='conn'), {})
+    domain = mocker.Mock(name='domain')
+    domain.name.return_value = 'cornac-db0'
+    domain.state.return_value = libvirt.VIR_DOMAIN_SHUTOFF, 0
+
+    def start():
+        domain.state.return_value = libvirt.VIR_DOMAIN_RUNNING, 0
+        iaas.wake_waiters(None, domain, None, None, None)
+
+    timer = threading.Timer(.1, start)
+    timer.start()
+    iaas.wait_state(domain, libvirt.VIR_DOMAIN_RUNNING, wait=5)
+    timer.join()
+    assert 2 == domain.state.call_count
+    assert not iaas.waiters
+
+    with pytest.raises(Timeout):
+        iaas.wait_state(domain, libvirt.VIR_DOMAIN_SHUTOFF, wait=.1)
+
+
+def test_vcenter_instant_clone(mocker):
+    pytest.importorskip('pyVmomi')
+    vim = mocker.patch('cornac.iaas.vcenter.vim')
+    vim.option.OptionValue.side_effect = dict
+    mocker.patch('cornac.iaas.vcenter.build_data_disk_spec')
+    mocker.patch('cornac.iaas.vcenter.RemoteShell')
+    from cornac.iaas.vcenter import vCenter
+
+    iaas = vCenter(si=mocker.Mock(name='si'), config=dict(
+        MACHINE_PREFIX='cornac-',
+        PHONE_HOME_SECRET=None,
+        PHONE_HOME_URL=None,
+        VCENTER_RESOURCE_POOL='dc1/host/cluster/Resources',
+    ))
+    mocker.patch.object(iaas, 'endpoint')
+    mocker.patch.object(iaas, 'ensure_parent')
+    mocker.patch.object(iaas, 'find')
+    mocker.patch.object(iaas, 'wait_task')
+    parent = iaas.ensure_parent.return_value
+
+    iaas.instant_clone('db0', 'dc1/datastore/ds1', 10)
+
+    spec = parent.InstantClone_Task.call_args[1]['spec']
+    assert 'cornac-db0' == spec.name
+    assert dict(key='guestinfo.cornac.hostname', value='cornac-db0') in (
+        spec.config)
+
+
+def test_vcenter_instant_clone_fallback(mocker):
+    pytest.importorskip('pyVmomi')
+    mocker.patch('cornac.iaas.vcenter.vim')
+    for builder in 'customization', 'data_disk', 'nic':
+        mocker.patch(f'cornac.iaas.vcenter.build_{builder}_spec')
+    from cornac.iaas.vcenter import vCenter
+
+    iaas = vCenter(si=mocker.Mock(name='si'), config=dict(
+        MACHINE_ORIGIN='dc1/vm/origin',
+        MACHINE_PREFIX='cornac-',
+        NETWORK='dc1/network/VM Network',
+        VCENTER_INSTANT_CLONE_PARENT='dc1/vm/parent',
+        VCENTER_RESOURCE_POOL='dc1/host/cluster/Resources',
+    ))
+    mocker.patch.object(
+        iaas, 'instant_clone', side_effect=Exception('Not supported.'))
+    mocker.patch.object(iaas, 'clone_machine')
+    mocker.patch.object(iaas, 'find')
+    mocker.patch.object(iaas, 'sysprep')
+    iaas.find.return_value.rootSnapshot = []
+
+    machine = iaas.create_machine('db0', 'dc1/datastore/ds1', 10)
+
+    assert iaas.instant_clone.called
+    assert machine is iaas.clone_machine.return_value
+    _, name, _ = iaas.clone_machine.call_args[0]
+    assert 'cornac-db0' == name
+    iaas.sysprep.assert_called_once_with(machine)
+
+
+def test_libvirt_overlay_xml():
+    pytest.importorskip('libvirt')
+    from xml.etree import ElementTree as ET
+    from cornac.iaas.libvirt import build_overlay_xml
+
+    xvol = ET.fromstring(build_overlay_xml(
+        'cornac-db0.qcow2', 1024, '/var/lib/libvirt/images/origin.img',
+        'raw'))
+
+    assert 'cornac-db0.qcow2' == xvol.find('./name').text
+    assert '1024' == xvol.find('./capacity').text
+    assert 'qcow2' == xvol.find('./target/format').attrib['type']
+    xbacking = xvol.find('./backingStore')
+    assert '/var/lib/libvirt/images/origin.img' == xbacking.find('./path').text
+    assert 'raw' == xbacking.find('./format').attrib['type']
+
+
+def test_libvirt_volume_xml():
+    pytest.importorskip('libvirt')
+    from xml.etree import ElementTree as ET
+    from cornac.iaas.libvirt import build_volume_xml
+
+    xvol = ET.fromstring(build_volume_xml(
+        'cornac-db0-data.qcow2', 1024, format_='qcow2', allocation=256))
+
+    assert 'cornac-db0-data.qcow2' == xvol.find('./name').text
+    assert '1024' == xvol.find('./capacity').text
+    assert '256' == xvol.find('./allocation').text
+    assert 'qcow2' == xvol.find('./target/format').attrib['type']
+    assert xvol.find('./backingStore') is None
+
+
+def test_cloudinit_seed():
+    import json
+    from cornac.iaas.cloudinit import build_seed
+
+    seed = build_seed('cornac-db0', ssh_key='ssh-rsa AAAA me@host')
+
+    assert ['meta-data', 'network-config', 'user-data'] == sorted(seed)
+    meta_data = json.loads(seed['meta-data'])
+    assert 'cornac-db0' == meta_data['local-hostname']
+    assert seed['user-data'].startswith('#cloud-config\n')
+    user_data = json.loads(seed['user-data'].partition('\n')[2])
+    assert 'cornac-db0' == user_data['hostname']
+    assert not user_data['disable_root']
+    root, = user_data['users']
+    assert ['ssh-rsa AAAA me@host'] == root['ssh_authorized_keys']
+
+    user_data = json.loads(build_seed('db1')['user-data'].partition('\n')[2])
+    assert 'users' not in user_data
+
+
+def test_ready_token():
+    from cornac.ready import build_token, check_token, phone_home_url
+
+    token = build_token('s3cret', 'cornac-db0')
+    assert 'cornac-db0' == check_token('s3cret', token)
+    assert check_token('other', token) is None
+    assert check_token('s3cret', token.replace('db0', 'db1')) is None
+    assert check_token('s3cret', 'garbage') is None
+
+    config = dict(PHONE_HOME_URL=None, PHONE_HOME_SECRET='s3cret')
+    assert phone_home_url(config, 'cornac-db0') is None
+    config['PHONE_HOME_URL'] = 'http://cornac:8001/'
+    assert f'http://cornac:8001/ready/{token}' == \
+        phone_home_url(config, 'cornac-db0')
+
+
+def test_ready_waiter(mocker):
+    from cornac.errors import Timeout
+    from cornac.ready import ReadyWaiter, wait_ready
+
+    listener = mocker.Mock(name='listener')
+    waiter = ReadyWaiter(listener)
+    probe = mocker.Mock(name='probe', side_effect=Exception('refused'))
+
+    with waiter.expect('cornac-db0') as event:
+        listener.subscribe.assert_called_once_with(
+            'machine_ready', waiter.notify)
+        waiter.notify(None)
+        waiter.notify('cornac-db1')
+        assert not event.is_set()
+        with pytest.raises(Timeout):
+            wait_ready(event, probe, timeout=.05, delays=[.02, .01])
+        # Probe at start, then after each delay, last one repeating.
+        assert 3 <= probe.call_count
+
+        waiter.notify('cornac-db0')
+        probe.reset_mock()
+        wait_ready(event, probe, timeout=5)
+        assert not probe.called
+
+    assert {} == waiter.events
+
+    # Guest ready before waiting.
+    with waiter.expect('cornac-db1') as event:
+        probe = mocker.Mock(name='probe')
+        wait_ready(event, probe, timeout=5, delays=[5])
+        probe.assert_called_once_with()
+
+
+def test_ready_endpoint(app, mocker):
+    db = mocker.patch('cornac.web.ready.db')
+    mocker.patch.dict(app.config, PHONE_HOME_SECRET='s3cret')
+    from cornac.ready import build_token
+
+    client = app.test_client()
+    assert 404 == client.post('/ready/cornac-db0.bad').status_code
+    assert not db.session.execute.called
+
+    token = build_token('s3cret', 'cornac-db0')
+    assert 204 == client.post(f'/ready/{token}').status_code
+    _, params = db.session.execute.call_args[0]
+    assert dict(channel='machine_ready', name='cornac-db0') == params
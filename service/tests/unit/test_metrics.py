@@ -0,0 +1,40 @@
+def test_registry():
+    from cornac.web.metrics import Registry
+
+    registry = Registry(['DescribeDBInstances', '-'], ['Throttling'], slots=2)
+    registry.count_request('DescribeDBInstances')
+    registry.count_request('UnknownAction')
+    registry.observe('DescribeDBInstances', 'auth', .001)
+    registry.count_error('Throttling')
+
+    # Simulate another worker.
+    registry.use_slot(1)
+    registry.count_request('DescribeDBInstances')
+    registry.observe('DescribeDBInstances', 'auth', 3)
+
+    values = registry.collect()
+    assert 2 == values['requests', 'DescribeDBInstances']
+    assert 1 == values['requests', '-']
+    assert 1 == values['errors', 'Throttling']
+
+    out = registry.render()
+    assert (
+        'cornac_rds_requests_total{action="DescribeDBInstances"} 2.0'
+        in out)
+    assert (
+        'cornac_rds_request_duration_seconds_bucket{'
+        'action="DescribeDBInstances",phase="auth",le="0.005"} 1.0'
+        in out)
+    assert (
+        'cornac_rds_request_duration_seconds_count{'
+        'action="DescribeDBInstances",phase="auth"} 2.0'
+        in out)
+
+
+def test_known_keys():
+    from cornac.web.metrics import list_actions, list_rdscodes
+
+    assert 'DescribeDBInstances' in list_actions()
+    assert 'DBInstance' not in list_actions()
+    assert 'InternalFailure' in list_rdscodes()
+    assert 'DBInstanceNotFound' in list_rdscodes()
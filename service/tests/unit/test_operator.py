@@ -0,0 +1,77 @@
+import pytest
+
+
+def test_create_from_warm_machine(mocker):
+    shell_cls = mocker.patch('cornac.operator.basic.RemoteShell')
+    shell = shell_cls.return_value
+    shell.return_value = ''
+    deploy_helpers = mocker.patch('cornac.operator.basic.deploy_helpers')
+    from cornac.operator import BasicOperator
+
+    iaas = mocker.Mock(name='iaas')
+    iaas.machine_name.side_effect = lambda name: 'cornac-' + name
+    operator = BasicOperator(iaas, {})
+    command = dict(
+        DBInstanceIdentifier='db0',
+        MasterUsername='postgres',
+        MasterUserPassword='secret',
+    )
+    response = operator.create_db_instance(command, warm='-warm-0')
+
+    assert not iaas.create_machine.called
+    deploy_helpers.assert_called_once_with(shell)
+    iaas.rename_machine.assert_called_once_with('-warm-0', 'db0')
+    iaas.start_machine.assert_called_once_with('db0')
+    commands = [c[0][0][1] for c in shell.call_args_list]
+    assert ['set-hostname'] == commands
+    commands = [c[1] for c in shell.batch.call_args[0][0]]
+    assert ['create-masteruser', 'create-database'] == commands
+    assert 'db0' == response['DBInstanceIdentifier']
+
+
+def test_claim_failure_deletes_warm_machine(mocker):
+    shell_cls = mocker.patch('cornac.operator.basic.RemoteShell')
+    mocker.patch('cornac.operator.basic.deploy_helpers')
+    from cornac.operator import BasicOperator
+
+    iaas = mocker.Mock(name='iaas')
+    iaas.rename_machine.side_effect = Exception('rename failed')
+    operator = BasicOperator(iaas, {})
+
+    with pytest.raises(Exception, match='rename failed'):
+        operator.claim_machine('-warm-0', 'db0')
+
+    assert shell_cls.called
+    iaas.delete_machine.assert_called_once_with('-warm-0')
+    assert not iaas.start_machine.called
+
+
+def test_provision_waits_phone_home(mocker):
+    mocker.patch('cornac.operator.basic.RemoteShell')
+    mocker.patch('cornac.operator.basic.deploy_helpers')
+    wait_ready = mocker.patch('cornac.operator.basic.wait_ready')
+    from cornac.operator import BasicOperator
+    from cornac.ready import ReadyWaiter
+
+    iaas = mocker.Mock(name='iaas')
+    iaas.machine_name.side_effect = lambda name: 'cornac-' + name
+    config = dict(
+        PHONE_HOME_SECRET='s3cret',
+        PHONE_HOME_URL='http://cornac:8001',
+        STORAGE_POOL='default',
+    )
+    operator = BasicOperator(
+        iaas, config, ready=ReadyWaiter(mocker.Mock(name='listener')))
+
+    # Provider did not configure guest to phone home.
+    operator.provision_machine('db0', 5)
+    assert iaas.create_machine.call_args[1]['ready'] is not None
+    assert not wait_ready.called
+
+    def create_machine(ready, **kw):
+        ready.injected = True
+        return mocker.DEFAULT
+
+    iaas.create_machine.side_effect = create_machine
+    operator.provision_machine('db0', 5)
+    assert wait_ready.called
@@ -1,3 +1,6 @@
+import pytest
+
+
 def test_password():
     from cornac.ssh import Password
 
@@ -5,3 +8,130 @@ def test_password():
 
     assert 'secret' not in str(my)
     assert 'secret' not in repr(my)
+
+
+def test_control_masters(mocker):
+    alive = True
+
+    def run_ssh(cmd, **kw):
+        # Fake master by creating socket file.
+        for option in cmd:
+            if option.startswith('ControlPath=') and '-f' in cmd:
+                open(option[len('ControlPath='):], 'w').close()
+        return mocker.Mock(returncode=0 if alive else 255)
+
+    run = mocker.patch('cornac.ssh.subprocess.run', side_effect=run_ssh)
+    register = mocker.patch('cornac.ssh.atexit.register')
+    from cornac.ssh import ControlMasters
+
+    masters = ControlMasters()
+    assert [] == masters.options('root', 'db0')
+    assert not run.called
+
+    masters.persist = 60
+    options = masters.options('root', 'db0')
+    assert 'ControlMaster=no' in options
+    assert run.called
+    master = run.call_args[0][0]
+    assert 'ControlMaster=yes' in master
+    assert 'ControlPersist=60' in master
+    assert 'ServerAliveInterval=15' in master
+    assert register.called
+
+    # Same process and host share master.
+    run.reset_mock()
+    assert options == masters.options('root', 'db0')
+    assert 1 == run.call_count
+    assert 'check' in run.call_args[0][0]
+    assert options != masters.options('root', 'db1')
+
+    # Dead master is restarted.
+    alive = False
+    run.reset_mock()
+    assert options == masters.options('root', 'db0')
+    assert 2 == run.call_count
+    assert 'ControlMaster=yes' in run.call_args[0][0]
+
+    run.reset_mock()
+    masters.close(masters.dir, masters.pid)
+    assert 2 == run.call_count
+    assert 'exit' in run.call_args[0][0]
+
+
+def test_control_masters_worker_exit(mocker):
+    import multiprocessing
+    import os
+
+    mocker.patch('cornac.ssh.subprocess.run')
+    from cornac.ssh import ControlMasters
+
+    ctx = multiprocessing.get_context('fork')
+    dirs = ctx.Queue()
+
+    def work():
+        # Like a dramatiq worker process.
+        masters = ControlMasters(persist=60)
+        masters.options('root', 'db0')
+        dirs.put(masters.dir)
+
+    process = ctx.Process(target=work)
+    process.start()
+    dir_ = dirs.get(timeout=10)
+    process.join(timeout=10)
+
+    assert 0 == process.exitcode
+    assert not os.path.exists(dir_)
+
+
+def test_deploy_helpers(mocker):
+    from cornac.helpers import HASH_PATH, deploy_helpers, helpers_archive
+
+    hash_, archive = helpers_archive()
+    shell = mocker.Mock(name='shell')
+
+    shell.return_value = ''
+    assert deploy_helpers(shell) is True
+    assert archive == shell.call_args[1]['input']
+
+    shell.reset_mock()
+    shell.return_value = hash_ + '\n'
+    assert deploy_helpers(shell) is False
+    assert 1 == shell.call_count
+    assert HASH_PATH in shell.call_args[0][0][-1]
+
+
+def test_batch():
+    from cornac.errors import RemoteCommandError
+    from cornac.ssh import Password, RemoteShell
+
+    # Run batch with local bash.
+    shell = RemoteShell('root', 'localhost')
+    shell.ssh = []
+    shell.options = list
+
+    steps = shell.batch([
+        ["echo", "it's", Password("secret")],
+        ["sh", "-c", "echo error >&2"],
+    ])
+    assert "it's secret\n" == steps[0].stdout
+    assert 0 == steps[0].exit_code
+    assert "error\n" == steps[1].stderr
+    assert steps[1].duration >= 0
+    assert 'secret' not in repr(steps[0].command)
+
+    with pytest.raises(RemoteCommandError) as ei:
+        shell.batch([
+            ["sh", "-c", "echo failed >&2; exit 3"],
+            ["touch", "/nonexistent/never-run"],
+        ])
+    assert 3 == ei.value.exit_code
+    assert "failed" == str(ei.value)
+
+
+def test_logged_cmd_input():
+    from cornac.ssh import logged_cmd
+
+    # More than a pipe buffer each way.
+    data = b'x' * 1024 * 1024
+    out = logged_cmd(["sh", "-c", "cat; echo done >&2"], input=data)
+    assert data.decode('utf-8') == out
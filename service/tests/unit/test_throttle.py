@@ -0,0 +1,39 @@
+import pytest
+
+
+def test_token_bucket():
+    from cornac.web.throttle import TokenBucket
+
+    now = [0.]
+    bucket = TokenBucket(rate=1, burst=2, clock=lambda: now[0])
+    assert bucket.consume()
+    assert bucket.consume()
+    assert not bucket.consume()
+
+    now[0] += .5
+    assert not bucket.consume()
+    now[0] += .5
+    assert bucket.consume()
+
+    # Never exceed burst.
+    now[0] += 60
+    assert bucket.consume()
+    assert bucket.consume()
+    assert not bucket.consume()
+
+
+def test_throttler():
+    from cornac.web.throttle import Throttler, errors
+
+    throttler = Throttler(
+        dict(describe=(1, 1), mutating=None), clock=lambda: 0)
+    throttler.check('KEY0', 'DescribeDBInstances')
+    with pytest.raises(errors.Throttling):
+        throttler.check('KEY0', 'DescribeDBInstances')
+
+    # Buckets are per access key.
+    throttler.check('KEY1', 'DescribeDBInstances')
+
+    # Unlimited class.
+    for _ in range(10):
+        throttler.check('KEY0', 'CreateDBInstance')
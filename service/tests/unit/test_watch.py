@@ -0,0 +1,11 @@
+def test_power_event_status():
+    from cornac.watch import power_event_status
+
+    assert ('stopped', None) == power_event_status('available', 'stopped')
+    assert ('failed', 'VM crashed.') == \
+        power_event_status('available', 'crashed')
+    # Postgres must be inspected.
+    assert power_event_status('stopped', 'running') is None
+    # Don't interfere with tasks.
+    assert power_event_status('stopping', 'stopped') is None
+    assert power_event_status('creating', 'crashed') is None
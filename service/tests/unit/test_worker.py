@@ -52,3 +52,80 @@ def test_state_manager(mocker):
         with state_manager(instance) as ctx:
             raise KnownError("Error")
     assert 'failed' == instance.status
+
+
+def test_inspected_status():
+    from cornac.worker import inspected_status
+
+    assert ('stopped', None) == inspected_status(False, None)
+    assert ('available', None) == inspected_status(True, True)
+    status, message = inspected_status(True, False)
+    assert 'failed' == status
+    assert 'Postgres' in message
+
+
+def test_build_status_update():
+    from sqlalchemy.dialects import postgresql
+    from cornac.worker import build_status_update
+
+    stmt = build_status_update({
+        1: ('available', None),
+        2: ('stopped', None),
+        3: ('failed', 'VM not found in IaaS.'),
+    })
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+
+    assert sql.startswith('UPDATE db_instances SET')
+    assert 'CAST(CASE db_instances.id WHEN' in sql
+    assert 'AS db_instance_status)' in sql
+    assert 'db_instances.status IN' in sql
+
+
+def test_provisioning_stage(mocker):
+    from flask import Flask
+
+    mocker.patch('cornac.worker.db')
+    mocker.patch('cornac.worker.borrow_iaas')
+    mocker.patch('cornac.worker.ReadyWaiter')
+    mocker.patch('cornac.worker.stage_semaphores', {})
+    from cornac.worker import provisioning_stage, TaskStop
+
+    app = Flask(__name__)
+    app.config['PROVISIONING_CONCURRENCY'] = dict(clone=1)
+    actor = mocker.Mock(name='actor')
+    instance = mocker.Mock(name='instance')
+    instance.status = 'creating'
+    instance.operator_data = dict(durations=dict(previous=1.))
+
+    with app.app_context():
+        with provisioning_stage(actor, instance, 'clone') as (ctx, operator):
+            assert ctx is instance
+            # Stage is full, delay instance.
+            with pytest.raises(TaskStop):
+                with provisioning_stage(actor, instance, 'clone'):
+                    assert False, "Stage must be full."
+            assert actor.send_with_options.called
+
+        assert 'creating' == instance.status
+        assert 'previous' in instance.operator_data['durations']
+        assert 'clone' in instance.operator_data['durations']
+
+        # Semaphore is released.
+        with provisioning_stage(actor, instance, 'clone', to_='available'):
+            pass
+        assert 'available' == instance.status
+
+
+def test_query_stale_warm_machines(app, mocker):
+    from sqlalchemy.dialects import postgresql
+    from cornac.worker import query_stale_warm_machines
+
+    # Query needs an engine, not a connection.
+    mocker.patch.dict(
+        app.config, SQLALCHEMY_DATABASE_URI='postgresql://127.0.0.1:9/cornac')
+    with app.app_context():
+        qry = query_stale_warm_machines('default', 3600)
+        sql = str(qry.statement.compile(dialect=postgresql.dialect()))
+
+    assert 'warm_machines.ready IS false' in sql
+    assert 'warm_machines.mtime < now() -' in sql
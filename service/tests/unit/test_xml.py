@@ -0,0 +1,27 @@
+from types import SimpleNamespace
+from xml.etree import ElementTree as ET
+
+
+def test_streamed_list():
+    from cornac.web.xml import (
+        InstanceEncoder,
+        iter_list_xml,
+        iter_response_xml,
+    )
+
+    instance = SimpleNamespace(
+        identifier='db<0>', status='available',
+        data=dict(Endpoint=dict(Address='db0.virt'), MultiAZ=False))
+
+    fragments = iter_response_xml(
+        'DescribeDBInstances', 'requestid',
+        iter_list_xml('DBInstances', [InstanceEncoder(instance)] * 2,
+                      marker=12))
+    xml = ET.fromstring(''.join(fragments))
+
+    result, = xml.findall('./{*}DescribeDBInstancesResult')
+    instances = result.findall('./{*}DBInstances/{*}DBInstance')
+    assert 2 == len(instances)
+    assert 'db<0>' == instances[0].find('./{*}DBInstanceIdentifier').text
+    assert 'false' == instances[0].find('./{*}MultiAZ').text
+    assert '12' == result.find('./{*}Marker').text